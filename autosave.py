@@ -0,0 +1,129 @@
+import json
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+
+MAGIC = b'DIGSAVE1'
+
+
+def write_snapshot(file_name, snapshot):
+    # header is json with the plain values, arrays follow it as compressed little-endian blobs
+    header = dict()
+    blobs = []
+    arrays = []
+    for name, value in snapshot.items():
+        if isinstance(value, array):
+            if sys.byteorder == 'big':
+                value = array(value.typecode, value)
+                value.byteswap()
+            blobs.append(zlib.compress(value.tobytes(), 1))
+            arrays.append([name, value.typecode, len(blobs[-1])])
+        else:
+            header[name] = value
+    header['arrays'] = arrays
+    header = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    with open(file_name, 'wb') as data:
+        data.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for blob in blobs:
+            data.write(blob)
+        data.flush()
+        os.fsync(data.fileno())
+
+
+def load_snapshot(file_name):
+    with open(file_name, 'rb') as data:
+        if data.read(len(MAGIC)) != MAGIC:
+            raise Exception('Файл не является сохранением: ' + file_name)
+        header_size = struct.unpack('<I', data.read(4))[0]
+        snapshot = json.loads(data.read(header_size).decode('utf-8'))
+        for name, typecode, size in snapshot.pop('arrays'):
+            value = array(typecode)
+            value.frombytes(zlib.decompress(data.read(size)))
+            if sys.byteorder == 'big':
+                value.byteswap()
+            snapshot[name] = value
+    return snapshot
+
+
+class Autosaver:
+    # The main thread only hands over a snapshot it has already copied, compression, writing and fsync happen
+    # on the writer thread. zlib and file io release the GIL, so the writer does not stall the frame.
+    # If the writer is still busy when the next snapshot arrives, only the newest pending snapshot is kept.
+    EVERY = 10
+    KEEP = 3
+    PREFIX = 'autosave_'
+    SUFFIX = '.sav'
+
+    def __init__(self, directory='saves', every=EVERY, keep=KEEP):
+        if every <= 0 or keep <= 0:
+            raise Exception('Период и число автосохранений должны быть положительными')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every = every
+        self.keep = keep
+        self.saved = 0
+        self.skipped = 0
+        self.error = None
+        self.pending = None
+        self.is_closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def is_due(self, turn_number):
+        return turn_number % self.every == 0
+
+    def save(self, snapshot):
+        with self.condition:
+            if self.pending is not None:
+                self.skipped += 1
+            self.pending = snapshot
+            self.condition.notify()
+
+    def get_saves(self):
+        names = [name for name in os.listdir(self.directory)
+                 if name.startswith(self.PREFIX) and name.endswith(self.SUFFIX)]
+        paths = [os.path.join(self.directory, name) for name in names]
+        return sorted(paths, key=os.path.getmtime)
+
+    def write_loop(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.is_closed:
+                    self.condition.wait()
+                if self.pending is None:
+                    break
+                snapshot, self.pending = self.pending, None
+            try:
+                self.write(snapshot)
+                self.saved += 1
+            except OSError as e:
+                self.error = e
+                print('Не удалось сохранить игру:', e)
+
+    def write(self, snapshot):
+        file_name = os.path.join(self.directory, '%s%06d%s' % (self.PREFIX, snapshot['turn_number'], self.SUFFIX))
+        # the old save is replaced only by a complete file, a crash leaves at most a stray .tmp
+        write_snapshot(file_name + '.tmp', snapshot)
+        os.replace(file_name + '.tmp', file_name)
+        self.sync_directory()
+        for old_file in self.get_saves()[:-self.keep]:
+            os.remove(old_file)
+
+    def sync_directory(self):
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify()
+        self.thread.join()
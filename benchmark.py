@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import pygame
+
+from main import Display, GameLoop, GameScene, GameLayerController, PLAYERS_NAMES
+from game import Game
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BOARD_SIZES = (10, 16, 50, 100, 200)
+UNIT_COUNTS = (12, 100, 1000)
+FRAMES = 600
+DELTA_TIME = 1 / 60
+SEED = 1
+
+
+class ScriptedInput:
+    PAN_FRAMES = 90
+    PAN_STEP = (-12, -7)
+    TURN_EVERY = 150
+    CENTER = (640, 360)
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.frame = 0
+        self.mouse_pos = self.CENTER
+
+    def get_events(self, delta_time=0):
+        pygame.event.pump()
+        events = []
+        if self.frame == 0:
+            events.append(pygame.event.Event(pygame.MOUSEMOTION, pos=self.mouse_pos))
+            events.append(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_c))
+            return self.next_frame(events)
+        if self.frame % self.TURN_EVERY == 0:
+            events.append(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_q))
+
+        pan_frame = (self.frame - 1) % (self.PAN_FRAMES * 2)
+        direction = 1 if pan_frame < self.PAN_FRAMES else -1
+        if pan_frame % self.PAN_FRAMES == 0:
+            self.mouse_pos = self.CENTER if direction == 1 else \
+                (self.CENTER[0] + self.PAN_STEP[0] * self.PAN_FRAMES, self.CENTER[1] + self.PAN_STEP[1] * self.PAN_FRAMES)
+            events.append(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=self.mouse_pos, button=pygame.BUTTON_RIGHT))
+            events.append(pygame.event.Event(pygame.MOUSEMOTION, pos=self.mouse_pos))
+            events.append(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=self.mouse_pos, button=pygame.BUTTON_RIGHT,
+                                             mods=0))
+        else:
+            self.mouse_pos = self.mouse_pos[0] + self.PAN_STEP[0] * direction, \
+                             self.mouse_pos[1] + self.PAN_STEP[1] * direction
+            events.append(pygame.event.Event(pygame.MOUSEMOTION, pos=self.mouse_pos))
+        return self.next_frame(events)
+
+    def next_frame(self, events):
+        self.frame += 1
+        if self.frame >= self.frames:
+            events.append(pygame.event.Event(pygame.QUIT))
+        return events
+
+    def close(self):
+        pass
+
+
+def create_game(board_size, unit_count):
+    random.seed(SEED)
+    game = Game(PLAYERS_NAMES, board_size=(board_size, board_size))
+    players_count = len(game.get_player())
+    i = len(game.get_units())
+    while i < unit_count:
+        pos = random.randrange(board_size), random.randrange(board_size)
+        if len(game.get_units_on_field(pos)) < Game.MAX_UNITS_ON_FIELD:
+            game.turn_number = i % players_count
+            game.add_unit(pos)
+            i += 1
+    game.turn_number = 0
+    return game
+
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_cell(board_size, unit_count, frames):
+    pygame.init()
+    pygame.font.init()
+    game = create_game(board_size, unit_count)
+    event_source = ScriptedInput(frames)
+    display = Display(scene=GameScene(layer_controller=GameLayerController(), game=game), event_source=event_source)
+    game_loop = GameLoop(display, fps=0, fixed_delta=DELTA_TIME)
+
+    frame_times = []
+    while not display.key_controller.is_quit:
+        start = time.perf_counter()
+        game_loop.tick()
+        frame_times.append(time.perf_counter() - start)
+    display.quit()
+
+    frame_times.sort()
+    total = sum(frame_times)
+    return {
+        'board_size': board_size,
+        'units': len(game.get_units()),
+        'frames': len(frame_times),
+        'fps': len(frame_times) / total if total > 0 else 0,
+        'p99_ms': frame_times[min(len(frame_times) - 1, round(0.99 * (len(frame_times) - 1)))] * 1000,
+        'peak_rss_mb': get_peak_rss_mb(),
+    }
+
+
+def run_matrix(board_sizes, unit_counts, frames):
+    results = []
+    for board_size in board_sizes:
+        for unit_count in unit_counts:
+            if unit_count > board_size * board_size * Game.MAX_UNITS_ON_FIELD // 2:
+                continue
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--cell', str(board_size), str(unit_count),
+                 '--frames', str(frames)],
+                stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print_result(result)
+            results.append(result)
+    return results
+
+
+def print_header():
+    print('%6s %6s %8s %9s %10s' % ('board', 'units', 'fps', 'p99 ms', 'rss MB'))
+
+
+def print_result(result):
+    rss = result['peak_rss_mb']
+    print('%6d %6d %8.1f %9.2f %10s' % (result['board_size'], result['units'], result['fps'], result['p99_ms'],
+                                         '%.1f' % rss if rss is not None else '-'))
+    sys.stdout.flush()
+
+
+def compare(results, baseline_file, tolerance):
+    with open(baseline_file, encoding='utf-8') as data:
+        baseline = {(r['board_size'], r['units']): r for r in json.load(data)}
+    failed = False
+    for result in results:
+        base = baseline.get((result['board_size'], result['units']))
+        if base is None:
+            continue
+        if result['fps'] < base['fps'] * (1 - tolerance) or result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            print(f'regression: board {result["board_size"]}, units {result["units"]}: '
+                  f'fps {base["fps"]:.1f} -> {result["fps"]:.1f}, p99 {base["p99_ms"]:.2f} -> {result["p99_ms"]:.2f} ms')
+            failed = True
+    return not failed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Замер отрисовки без окна (видеодрайвер SDL dummy)')
+    parser.add_argument('--sizes', type=int, nargs='+', default=BOARD_SIZES, help='размеры поля')
+    parser.add_argument('--units', type=int, nargs='+', default=UNIT_COUNTS, help='число юнитов')
+    parser.add_argument('--frames', type=int, default=FRAMES, help='кадров на каждую ячейку')
+    parser.add_argument('--out', metavar='FILE', help='записать результаты в JSON')
+    parser.add_argument('--compare', metavar='FILE', help='завершиться с ошибкой, если результаты хуже базовых из JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимое ухудшение для --compare (доля)')
+    parser.add_argument('--cell', type=int, nargs=2, metavar=('SIZE', 'UNITS'), help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.cell is not None:
+        print(json.dumps(run_cell(args.cell[0], args.cell[1], args.frames)))
+        sys.exit(0)
+
+    print_header()
+    results = run_matrix(args.sizes, args.units, args.frames)
+    if args.out is not None:
+        with open(args.out, 'w', encoding='utf-8') as data:
+            json.dump(results, data, indent=2)
+    if args.compare is not None and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
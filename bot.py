@@ -0,0 +1,157 @@
+import multiprocessing
+import pickle
+import random
+import time
+from game import Game, ActionTypes, FIELD_PROPERTIES, get_dist
+
+# bot actions use the format of Game.apply_actions; the game scene applies them one by one to animate every move
+BotActions = ActionTypes
+
+
+class GreedyBot:
+    TARGET_RESOURCES = ('diamond', 'gold')
+
+    def __init__(self, game: Game):
+        self.game = game
+        self.player = game.get_cur_player()
+
+    def get_target(self, unit):
+        targets = [(self.game.get_resource_distance(unit.pos, name), self.game.get_nearest_resource(unit.pos, name))
+                   for name in self.TARGET_RESOURCES]
+        targets = [target for target in targets if target[0] is not None]
+        return min(targets)[1] if targets else None
+
+    def is_digging(self, unit):
+        return FIELD_PROPERTIES[self.game.get_field_by_coord(unit.pos).type]['resource'] in self.TARGET_RESOURCES
+
+    def get_step(self, unit, target):
+        best, best_dist = None, get_dist(unit.pos, target)
+        for new_pos in sorted(self.game.get_legal_moves(unit.id)):
+            if get_dist(new_pos, target) < best_dist:
+                best, best_dist = new_pos, get_dist(new_pos, target)
+        return best
+
+    def compute(self, deadline):
+        actions = []
+        if self.game.buy_unit():
+            actions.append((BotActions.BUY,))
+        for unit in self.game.get_units(self.player):
+            target = self.get_target(unit)
+            if target is None:
+                break
+            while time.monotonic() < deadline and not self.is_digging(unit):
+                new_pos = self.get_step(unit, target)
+                if new_pos is None or not self.game.move_unit(unit.id, new_pos):
+                    break
+                actions.append((BotActions.MOVE, unit.id, new_pos))
+            if time.monotonic() >= deadline:
+                break
+        return actions
+
+
+class RandomBot:
+    BUY_CHANCE = 0.5
+
+    def __init__(self, game: Game):
+        self.game = game
+        self.player = game.get_cur_player()
+
+    def compute(self, deadline):
+        actions = []
+        if random.random() < self.BUY_CHANCE and self.game.buy_unit():
+            actions.append((BotActions.BUY,))
+        for unit in self.game.get_units(self.player):
+            if time.monotonic() >= deadline:
+                break
+            moves = sorted(self.game.get_legal_moves(unit.id))
+            if moves:
+                new_pos = random.choice(moves)
+                if self.game.move_unit(unit.id, new_pos):
+                    actions.append((BotActions.MOVE, unit.id, new_pos))
+        return actions
+
+
+class IdleBot:
+    def __init__(self, game: Game):
+        self.game = game
+
+    def compute(self, deadline):
+        return [(BotActions.BUY,)] if self.game.buy_unit() else []
+
+
+BOT_POLICIES = {
+    'greedy': GreedyBot,
+    'random': RandomBot,
+    'idle': IdleBot,
+}
+
+
+def compute_turn(snapshot, time_limit, policy='greedy'):
+    deadline = time.monotonic() + time_limit
+    if isinstance(snapshot, bytes):
+        game = pickle.loads(snapshot)
+    else:
+        # a forked worker got the game itself, its listeners belong to the parent's view
+        game = snapshot
+        game.clear_listeners()
+    return BOT_POLICIES[policy](game).compute(deadline)
+
+
+def run_worker(conn, snapshot, time_limit, policy):
+    conn.send(compute_turn(snapshot, time_limit, policy))
+    conn.close()
+
+
+class BotController:
+    TIME_LIMIT = 2.0
+    GRACE_TIME = 1.0
+    # spawn re-imports main.py in the worker, and texture_loader opens a window on import
+    START_METHOD = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+
+    def __init__(self, time_limit=TIME_LIMIT, policy='greedy'):
+        self.time_limit = time_limit
+        self.policy = policy
+        self._process = None
+        self._conn = None
+        self._started = 0
+
+    def start(self, game: Game):
+        context = multiprocessing.get_context(self.START_METHOD)
+        self._conn, child_conn = context.Pipe(duplex=False)
+        # a forked worker inherits the game with the parent's memory, pickling it would stall the frame
+        snapshot = game if self.START_METHOD == 'fork' else pickle.dumps(game)
+        self._process = context.Process(
+            target=run_worker, args=(child_conn, snapshot, self.time_limit, self.policy), daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._started = time.monotonic()
+
+    def is_thinking(self):
+        return self._process is not None
+
+    def poll(self):
+        if self._process is None:
+            return None
+        is_alive = self._process.is_alive()
+        if self._conn.poll():
+            try:
+                actions = self._conn.recv()
+            except (EOFError, OSError):
+                actions = []
+            self.cancel()
+            return actions
+        if not is_alive or time.monotonic() - self._started > self.time_limit + self.GRACE_TIME:
+            # the worker crashed or missed its deadline, the turn passes without actions
+            self.cancel()
+            return []
+        return None
+
+    def cancel(self):
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+        self._conn.close()
+        self._process = None
+        self._conn = None
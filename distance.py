@@ -0,0 +1,133 @@
+import heapq
+from array import array
+
+
+class DistanceFields:
+    # a path costs 1 per step plus max_health of every non-tunnel cell it has to dig through on the way
+    INF = 2 ** 31 - 1
+
+    def __init__(self, board, field_properties, tunnel_type):
+        self.board = board
+        self.width, self.height = board.size
+        self.tunnel_type = tunnel_type
+        self.max_health = [ground['max_health'] for ground in field_properties]
+        self.resources = [ground['resource'] for ground in field_properties]
+        self.resources_names = sorted(set(name for name in self.resources if name is not None))
+        self.types = array('b', [0]) * (self.width * self.height)
+        for y in range(self.height):
+            for x in range(self.width):
+                self.types[y * self.width + x] = board.get_field((x, y)).type
+        self.dist = dict()
+        for res_name in self.resources_names:
+            self.dist[res_name] = array('l', [self.INF]) * (self.width * self.height)
+            self._build(res_name)
+
+    def _neighbours(self, i):
+        x, y = i % self.width, i // self.width
+        if x > 0:
+            yield i - 1
+        if x < self.width - 1:
+            yield i + 1
+        if y > 0:
+            yield i - self.width
+        if y < self.height - 1:
+            yield i + self.width
+
+    def _is_source(self, res_name, i):
+        return self.resources[self.types[i]] == res_name
+
+    def _get_step(self, res_name, i):
+        field_type = self.types[i]
+        if field_type == self.tunnel_type or self.resources[field_type] == res_name:
+            return 1
+        return 1 + self.max_health[field_type]
+
+    def _run(self, res_name, heap):
+        dist = self.dist[res_name]
+        while heap:
+            d, i = heapq.heappop(heap)
+            if d != dist[i]:
+                continue
+            new_dist = d + self._get_step(res_name, i)
+            for j in self._neighbours(i):
+                if new_dist < dist[j]:
+                    dist[j] = new_dist
+                    heapq.heappush(heap, (new_dist, j))
+
+    def _build(self, res_name):
+        dist = self.dist[res_name]
+        heap = []
+        for i in range(len(dist)):
+            if self._is_source(res_name, i):
+                dist[i] = 0
+                heap.append((0, i))
+        heapq.heapify(heap)
+        self._run(res_name, heap)
+
+    def _is_supported(self, res_name, i, invalid):
+        if self._is_source(res_name, i):
+            return self.dist[res_name][i] == 0
+        dist = self.dist[res_name]
+        for j in self._neighbours(i):
+            if j not in invalid and dist[j] != self.INF and dist[j] + self._get_step(res_name, j) == dist[i]:
+                return True
+        return False
+
+    def _repair(self, res_name, i):
+        dist = self.dist[res_name]
+        # cells whose shortest path went through the changed cell lose their distance
+        invalid = set()
+        stack = [i]
+        stack.extend(self._neighbours(i))
+        while stack:
+            j = stack.pop()
+            if j in invalid or dist[j] == self.INF or self._is_supported(res_name, j, invalid):
+                continue
+            invalid.add(j)
+            stack.extend(self._neighbours(j))
+        for j in invalid:
+            dist[j] = self.INF
+        # the invalidated cells are refilled from their valid borders, the changed cell may also shorten paths
+        heap = []
+        invalid.add(i)
+        for j in invalid:
+            if self._is_source(res_name, j):
+                best = 0
+            else:
+                best = dist[j]
+                for k in self._neighbours(j):
+                    if dist[k] != self.INF:
+                        best = min(best, dist[k] + self._get_step(res_name, k))
+            dist[j] = best
+            if best != self.INF:
+                heap.append((best, j))
+        heapq.heapify(heap)
+        self._run(res_name, heap)
+
+    def on_field_changed(self, pos: [int, int]):
+        i = pos[1] * self.width + pos[0]
+        field_type = self.board.get_field(pos).type
+        if self.types[i] == field_type:
+            return
+        self.types[i] = field_type
+        for res_name in self.resources_names:
+            self._repair(res_name, i)
+
+    def get_distance(self, res_name, pos: [int, int]):
+        d = self.dist[res_name][pos[1] * self.width + pos[0]]
+        return d if d != self.INF else None
+
+    def get_path(self, res_name, pos: [int, int]):
+        dist = self.dist[res_name]
+        i = pos[1] * self.width + pos[0]
+        if dist[i] == self.INF:
+            return None
+        path = [(pos[0], pos[1])]
+        while dist[i] != 0:
+            i = min(self._neighbours(i), key=lambda j: dist[j] + self._get_step(res_name, j))
+            path.append((i % self.width, i // self.width))
+        return path
+
+    def get_nearest(self, res_name, pos: [int, int]):
+        path = self.get_path(res_name, pos)
+        return path[-1] if path is not None else None
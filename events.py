@@ -0,0 +1,43 @@
+class GameEvent:
+    FIELDS = ()
+
+    def __init__(self, *args):
+        for name, value in zip(self.FIELDS, args):
+            setattr(self, name, value)
+
+    def to_dict(self):
+        res = {'event': type(self).__name__}
+        res.update((name, getattr(self, name)) for name in self.FIELDS)
+        return res
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + ', '.join(f'{name}={getattr(self, name)!r}' for name in self.FIELDS) + ')'
+
+
+class FieldChanged(GameEvent):
+    FIELDS = ('pos', 'type', 'health')
+
+
+class UnitMoved(GameEvent):
+    FIELDS = ('unit_id', 'old_pos', 'new_pos')
+
+
+class UnitAdded(GameEvent):
+    FIELDS = ('unit_id', 'pos', 'player_num')
+
+
+class ResourcesChanged(GameEvent):
+    FIELDS = ('player_num', 'resources')
+
+
+class TurnChanged(GameEvent):
+    FIELDS = ('turn_number', 'player_num')
+
+
+EVENT_TYPES = dict((event_type.__name__, event_type)
+                   for event_type in (FieldChanged, UnitMoved, UnitAdded, ResourcesChanged, TurnChanged))
+
+
+def dict_to_event(data):
+    event_type = EVENT_TYPES[data['event']]
+    return event_type(*[data[name] for name in event_type.FIELDS])
@@ -0,0 +1,171 @@
+from array import array
+
+
+class FogOfWar:
+    UNIT_SIGHT = 2
+    TUNNEL_SIGHT = 1
+
+    def __init__(self, game, tunnel_type):
+        self.game = game
+        self.tunnel_type = tunnel_type
+        self.width, self.height = game.get_board().size
+        self.players_count = len(game.get_player())
+        self.counts = [array('H', [0]) * (self.width * self.height) for _ in range(self.players_count)]
+        self.changed = [set() for _ in range(self.players_count)]
+        self._parent = dict()
+        self._members = dict()
+        self._occupancy = dict()
+        self._offsets = dict()
+
+        # on_tunnel_created already counts the units standing in the tunnels, so the existing units
+        # only add their own sight here
+        for y in range(self.height):
+            for x in range(self.width):
+                if self._is_tunnel((x, y)):
+                    self.on_tunnel_created((x, y))
+        for unit in game.get_units():
+            self._cover(game.get_player_num(unit.player), unit.pos, self.UNIT_SIGHT, 1)
+
+    def _index(self, pos):
+        return pos[1] * self.width + pos[0]
+
+    def _is_tunnel(self, pos):
+        return self.game.get_field_by_coord(pos).type == self.tunnel_type
+
+    def _get_offsets(self, radius):
+        if radius not in self._offsets:
+            self._offsets[radius] = [(dx, dy) for dy in range(-radius, radius + 1)
+                                     for dx in range(-radius, radius + 1) if abs(dx) + abs(dy) <= radius]
+        return self._offsets[radius]
+
+    def _cover(self, player_num, pos, radius, delta):
+        counts = self.counts[player_num]
+        changed = self.changed[player_num]
+        for dx, dy in self._get_offsets(radius):
+            x, y = pos[0] + dx, pos[1] + dy
+            if 0 <= x < self.width and 0 <= y < self.height:
+                i = y * self.width + x
+                counts[i] += delta
+                if (counts[i] > 0) != (counts[i] - delta > 0):
+                    changed.add((x, y))
+
+    def _cover_cells(self, player_num, cells, delta):
+        for pos in cells:
+            self._cover(player_num, pos, self.TUNNEL_SIGHT, delta)
+
+    def _find(self, i):
+        root = i
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[i] != root:
+            self._parent[i], i = root, self._parent[i]
+        return root
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if a == b:
+            return
+        if len(self._members[a]) < len(self._members[b]):
+            a, b = b, a
+        occupancy_a, occupancy_b = self._occupancy[a], self._occupancy[b]
+        for player_num in range(self.players_count):
+            if occupancy_a[player_num] > 0 and occupancy_b[player_num] == 0:
+                self._cover_cells(player_num, self._members[b], 1)
+            elif occupancy_b[player_num] > 0 and occupancy_a[player_num] == 0:
+                self._cover_cells(player_num, self._members[a], 1)
+            occupancy_a[player_num] += occupancy_b[player_num]
+        self._parent[b] = a
+        self._members[a].extend(self._members.pop(b))
+        del self._occupancy[b]
+
+    def _enter(self, player_num, pos):
+        i = self._index(pos)
+        if i not in self._parent:
+            return
+        root = self._find(i)
+        self._occupancy[root][player_num] += 1
+        if self._occupancy[root][player_num] == 1:
+            self._cover_cells(player_num, self._members[root], 1)
+
+    def _leave(self, player_num, pos):
+        i = self._index(pos)
+        if i not in self._parent:
+            return
+        root = self._find(i)
+        self._occupancy[root][player_num] -= 1
+        if self._occupancy[root][player_num] == 0:
+            self._cover_cells(player_num, self._members[root], -1)
+
+    def add_unit(self, unit):
+        player_num = self.game.get_player_num(unit.player)
+        self._cover(player_num, unit.pos, self.UNIT_SIGHT, 1)
+        self._enter(player_num, unit.pos)
+
+    def move_unit(self, unit, old_pos):
+        player_num = self.game.get_player_num(unit.player)
+        self._cover(player_num, old_pos, self.UNIT_SIGHT, -1)
+        self._leave(player_num, old_pos)
+        self._cover(player_num, unit.pos, self.UNIT_SIGHT, 1)
+        self._enter(player_num, unit.pos)
+
+    def on_tunnel_created(self, pos):
+        i = self._index(pos)
+        if i in self._parent:
+            return
+        occupancy = [0] * self.players_count
+        for unit in self.game.get_units_on_field(pos):
+            occupancy[self.game.get_player_num(unit.player)] += 1
+        self._parent[i] = i
+        self._members[i] = [tuple(pos)]
+        self._occupancy[i] = occupancy
+        for player_num in range(self.players_count):
+            if occupancy[player_num] > 0:
+                self._cover(player_num, pos, self.TUNNEL_SIGHT, 1)
+        for dx, dy in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            x, y = pos[0] + dx, pos[1] + dy
+            if 0 <= x < self.width and 0 <= y < self.height and self._index((x, y)) in self._parent:
+                self._union(i, self._index((x, y)))
+
+    def is_visible(self, player_num, pos):
+        if 0 <= pos[0] < self.width and 0 <= pos[1] < self.height:
+            return self.counts[player_num][pos[1] * self.width + pos[0]] > 0
+        return False
+
+    def get_visible_indices(self, player_num):
+        return [i for i, count in enumerate(self.counts[player_num]) if count > 0]
+
+    def pop_changes(self, player_num):
+        changes = self.changed[player_num]
+        self.changed[player_num] = set()
+        return changes
+
+    def clear_changes(self):
+        self.changed = [set() for _ in range(self.players_count)]
+
+
+def check(games=20, turns=30, seed=0):
+    # plays random turns and compares the incremental fog with one built from scratch after every turn
+    import random
+    from game import Game, FieldTypes
+
+    rng = random.Random(seed)
+    for game_num in range(games):
+        random.seed(seed + game_num)
+        size = rng.choice((10, 13, 16))
+        game = Game(['a', 'b', 'c', 'd'][:rng.randint(2, 4)], board_size=(size, size), fog_of_war=True)
+        for turn in range(turns):
+            for unit in game.get_units(game.get_cur_player()):
+                moves = sorted(game.get_legal_moves(unit.id))
+                if moves:
+                    game.move_unit(unit.id, rng.choice(moves))
+            if rng.random() < 0.3:
+                game.buy_unit()
+            game.next_turn()
+            fresh = FogOfWar(game, FieldTypes.TUNNEL)
+            if [list(counts) for counts in game.fog.counts] != [list(counts) for counts in fresh.counts]:
+                raise Exception(f'Туман расходится с пересчётом: игра {game_num}, ход {turn}')
+    print(f'fog ok: {games} games, {turns} turns each')
+
+
+if __name__ == '__main__':
+    check()
@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import queue
+import struct
+import time
+import zlib
+from multiprocessing import shared_memory
+import pygame
+
+TO_BYTES = getattr(pygame.image, 'tobytes', None) or pygame.image.tostring
+
+
+def encode_png(data, size, level=1):
+    width, height = size
+    stride = width * 3
+    # RGB rows with filter type 0 (none), level 1 keeps the compression cheap. The rows are fed to the
+    # compressor straight from the frame instead of being joined into one buffer first
+    compressor = zlib.compressobj(level)
+    rows = memoryview(data)
+    idat = []
+    for y in range(height):
+        idat.append(compressor.compress(b'\x00'))
+        idat.append(compressor.compress(rows[y * stride:(y + 1) * stride]))
+    idat.append(compressor.flush())
+
+    def chunk(tag, body):
+        return struct.pack('>I', len(body)) + tag + body + struct.pack('>I', zlib.crc32(tag + body) & 0xffffffff)
+
+    return b'\x89PNG\r\n\x1a\n' + \
+           chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) + \
+           chunk(b'IDAT', b''.join(idat)) + \
+           chunk(b'IEND', b'')
+
+
+def write_frames(directory, file_format, frames, slot_size, tasks, done):
+    # runs in the writer process, so converting and compressing the frames never holds the game's GIL
+    index = open(os.path.join(directory, 'index.csv'), 'a', encoding='utf-8')
+    raw_file = open(os.path.join(directory, 'frames.rgb'), 'wb') if file_format == 'raw' else None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        frame_num, frame_time, size, slot = task
+        start = slot * slot_size
+        data = bytes(frames.buf[start:start + size[0] * size[1] * 4])
+        done.put(slot)
+        # the screen has no alpha, its fourth byte is padding, so the frame is stored as RGB
+        data = TO_BYTES(pygame.image.frombuffer(data, size, 'RGBX'), 'RGB')
+        if raw_file is not None:
+            offset = raw_file.tell()
+            raw_file.write(data)
+            file_name = 'frames.rgb'
+        else:
+            offset = 0
+            file_name = 'frame_%06d.png' % frame_num
+            with open(os.path.join(directory, file_name), 'wb') as image:
+                image.write(encode_png(data, size))
+        index.write(f'{frame_num},{frame_time:.6f},{size[0]},{size[1]},{file_name},{offset}\n')
+    index.close()
+    if raw_file is not None:
+        raw_file.close()
+    frames.close()
+
+
+class FrameRecorder:
+    # Drop policy: the main thread never waits for the writer. Frames are copied into slots of a shared buffer
+    # of queue_bytes. When no slot is free the frame being captured is dropped without grabbing it and the
+    # frames already queued are kept, so the written sequence only has gaps, never reordered frames. Every
+    # written frame is listed in index.csv with its capture time, and the number of dropped frames is written
+    # at the end of the index.
+    # The main thread only grabs the screen as RGBX, the cheapest conversion of the screen buffer, the writer
+    # process turns it into RGB and encodes it.
+    FORMATS = ('png', 'raw')
+    QUEUE_BYTES = 64 * 1024 * 1024
+    # spawn re-imports main.py in the writer, and texture_loader opens a window on import
+    START_METHOD = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+
+    def __init__(self, directory, file_format='png', queue_bytes=QUEUE_BYTES):
+        if file_format not in self.FORMATS:
+            raise Exception('Неизвестный формат записи: ' + file_format)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.file_format = file_format
+        self.queue_bytes = queue_bytes
+        self.frame = 0
+        self.dropped = 0
+        self.start_time = time.perf_counter()
+        with open(os.path.join(directory, 'index.csv'), 'w', encoding='utf-8') as index:
+            index.write('frame,time,width,height,file,offset\n')
+        self.frames = None
+        self.slot_size = 0
+        self.free_slots = []
+        self.tasks = None
+        self.done = None
+        self.process = None
+
+    def start(self, size):
+        # the slots are sized by the first frame, the display keeps its size for the whole game
+        self.slot_size = size[0] * size[1] * 4
+        slots = max(1, self.queue_bytes // self.slot_size)
+        self.frames = shared_memory.SharedMemory(create=True, size=slots * self.slot_size)
+        self.free_slots = list(range(slots))
+        context = multiprocessing.get_context(self.START_METHOD)
+        self.tasks = context.Queue()
+        self.done = context.Queue()
+        self.process = context.Process(
+            target=write_frames,
+            args=(self.directory, self.file_format, self.frames, self.slot_size, self.tasks, self.done), daemon=True)
+        self.process.start()
+
+    def capture(self, surface):
+        width, height = surface.get_size()
+        frame_num = self.frame
+        self.frame += 1
+        if self.process is None:
+            self.start((width, height))
+        while True:
+            try:
+                self.free_slots.append(self.done.get_nowait())
+            except queue.Empty:
+                break
+        if len(self.free_slots) == 0 or width * height * 4 > self.slot_size:
+            self.dropped += 1
+            return
+        slot = self.free_slots.pop()
+        start = slot * self.slot_size
+        self.frames.buf[start:start + width * height * 4] = TO_BYTES(surface, 'RGBX')
+        self.tasks.put((frame_num, time.perf_counter() - self.start_time, (width, height), slot))
+
+    def close(self):
+        if self.process is not None:
+            self.tasks.put(None)
+            self.process.join()
+            self.frames.close()
+            self.frames.unlink()
+        with open(os.path.join(self.directory, 'index.csv'), 'a', encoding='utf-8') as index:
+            index.write(f'# captured {self.frame}, dropped {self.dropped}\n')
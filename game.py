@@ -1,5 +1,10 @@
 import os
 import json
+from array import array
+from distance import DistanceFields
+from events import FieldChanged, UnitMoved, UnitAdded, ResourcesChanged, TurnChanged
+from fog import FogOfWar
+from stats import TurnStats
 
 
 def get_dist(pos1: [int, int], pos2: [int, int]):
@@ -37,6 +42,12 @@ class ResourcesTypes:
         return ResourcesTypes.NAMES.index(res_name)
 
 
+class ActionTypes:
+    MOVE = 'move'
+    BUY = 'buy'
+    SPEED_UP = 'speed_up'
+
+
 class Player:
     def __init__(self, name: str, resources: [int, int, int]):
         self.name = name
@@ -116,28 +127,63 @@ class Field(object):
 
 
 class Board(object):
-    def __init__(self, size=(10, 10)):
+    def __init__(self, size=(10, 10), types=None, health=None):
         self.size = size
+        self.distances = None
         import random
         self._fields = []
         for y in range(size[1]):
             self._fields.append([])
             for x in range(size[0]):
-                self._fields[y].append(Field(random.choice([1, 2, 4, 5, 6])))
-        for i in range(10):
-            y = random.randint(0, size[1] - 1)
-            x = random.randint(0, size[0] - 1)
-            self._fields[y][x] = Field(FieldTypes.DIAMOND)
+                if types is not None:
+                    field = Field(types[y * size[0] + x])
+                    field.cur_health = health[y * size[0] + x]
+                else:
+                    field = Field(random.choice([1, 2, 4, 5, 6]))
+                self._fields[y].append(field)
+        if types is None:
+            for i in range(10):
+                y = random.randint(0, size[1] - 1)
+                x = random.randint(0, size[0] - 1)
+                self._fields[y][x] = Field(FieldTypes.DIAMOND)
+        # flat copies of the fields state, kept in sync so a snapshot of the board is a plain array copy
+        self.types = array('b', [field.type for line in self._fields for field in line])
+        self.health = array('i', [field.cur_health for line in self._fields for field in line])
 
     def get_field(self, pos: [int, int]) -> Field or None:
         if 0 <= pos[1] < len(self._fields) and 0 <= pos[0] < len(self._fields[pos[1]]):
             return self._fields[pos[1]][pos[0]]
         return None
 
-    def update(self, cur_player):
-        for line in self._fields:
-            for field in line:
-                field.update(cur_player)
+    def init_field(self, pos: [int, int], field_type):
+        field = self._fields[pos[1]][pos[0]]
+        field.init(field_type)
+        self._sync_field(pos, field)
+
+    def _sync_field(self, pos, field):
+        i = pos[1] * self.size[0] + pos[0]
+        self.types[i] = field.type
+        self.health[i] = field.cur_health
+
+    def init_distances(self):
+        self.distances = DistanceFields(self, FIELD_PROPERTIES, FieldTypes.TUNNEL)
+
+    def update(self, cur_player, positions=None):
+        # only fields with the player's units change, callers that know them pass their positions
+        if positions is None:
+            positions = [(x, y) for y in range(self.size[1]) for x in range(self.size[0])]
+        changed = []
+        for pos in positions:
+            field = self._fields[pos[1]][pos[0]]
+            old_type = field.type
+            field.update(cur_player)
+            self._sync_field(pos, field)
+            if field.type != old_type:
+                changed.append((pos, old_type))
+        if self.distances is not None:
+            for pos, old_type in changed:
+                self.distances.on_field_changed(pos)
+        return changed
 
     def __str__(self):
         return str([[field.__str__() for field in line] for line in self._fields])
@@ -148,16 +194,47 @@ class Game(object):
     MAX_UNIT_SPEED = 3
     UNIT_COST = 5
     SPEED_UP_COST = 2
+    ACTION_SIZES = {ActionTypes.MOVE: 3, ActionTypes.BUY: 1, ActionTypes.SPEED_UP: 2}
     START_UNIT_COUNT = 3
     START_RESOURCES_COUNT = [0, 10, 0]
 
-    def __init__(self, players_names: list, board_size: [int, int] = (10, 10)):
+    def __init__(self, players_names: list, board_size: [int, int] = (10, 10), fog_of_war=False,
+                 stats_capacity=TurnStats.DEFAULT_CAPACITY, seats=None, snapshot=None):
+        self.seats = tuple(seats) if seats is not None else tuple(range(len(players_names)))
+        self._listeners = []
         self.unit_count = 0
         self.turn_number = 0
         self._units = []
         self._board = None
         self._players = []
-        self.init_game(players_names, board_size)
+        self._legal_moves = dict()
+        self.fog = None
+        self.stats = None
+        if snapshot is not None:
+            self.restore(snapshot)
+        else:
+            self.init_game(players_names, board_size)
+        self._board.init_distances()
+        if fog_of_war:
+            self.fog = FogOfWar(self, FieldTypes.TUNNEL)
+        self.stats = TurnStats(self, ResourcesTypes.NAMES, [ground['name'] for ground in FIELD_PROPERTIES],
+                               stats_capacity)
+
+    def __getstate__(self):
+        # listeners belong to the view and are not part of a game snapshot
+        state = self.__dict__.copy()
+        state['_listeners'] = []
+        return state
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def clear_listeners(self):
+        self._listeners = []
+
+    def notify(self, event):
+        for listener in self._listeners:
+            listener(event)
 
     def get_board(self):
         return self._board
@@ -167,24 +244,86 @@ class Game(object):
         self._players = [Player(name, self.START_RESOURCES_COUNT[:]) for name in players_names]
         bases = self.get_bases_coord()
         for i in range(len(self._players)):
-            self._board.get_field(bases[i][0]).init(FieldTypes.TUNNEL)
-            self._board.get_field(bases[i][1]).init(FieldTypes.TUNNEL)
+            self._board.init_field(bases[i][0], FieldTypes.TUNNEL)
+            self._board.init_field(bases[i][1], FieldTypes.TUNNEL)
             for j in range(self.START_UNIT_COUNT):
                 self.add_unit(bases[i][0])
             self.next_turn()
         self.turn_number = 0
 
+    UNIT_COLUMNS = ('id', 'x', 'y', 'player_num', 'cur_speed', 'max_speed', 'is_speed_up')
+
+    def get_snapshot(self):
+        # only array copies and one pass over the units, cheap enough to take at every turn change
+        players_nums = dict((player, i) for i, player in enumerate(self._players))
+        units = array('i', [value for unit in self._units for value in (
+            unit.id, unit.pos[0], unit.pos[1], players_nums[unit.player], unit.cur_speed, unit.max_speed,
+            unit.is_speed_up)])
+        return {
+            'turn_number': self.turn_number,
+            'unit_count': self.unit_count,
+            'board_size': list(self._board.size),
+            'seats': list(self.seats),
+            'fog_of_war': self.fog is not None,
+            'players': [{'name': player.name, 'resources': player.resources[:]} for player in self._players],
+            'types': self._board.types[:],
+            'health': self._board.health[:],
+            'units': units,
+        }
+
+    @staticmethod
+    def from_snapshot(snapshot, stats_capacity=TurnStats.DEFAULT_CAPACITY):
+        return Game([player['name'] for player in snapshot['players']], tuple(snapshot['board_size']),
+                    snapshot['fog_of_war'], stats_capacity, snapshot['seats'], snapshot)
+
+    def restore(self, snapshot):
+        self._board = Board(tuple(snapshot['board_size']), snapshot['types'], snapshot['health'])
+        self._players = [Player(player['name'], list(player['resources'])) for player in snapshot['players']]
+        self._units = []
+        columns = len(self.UNIT_COLUMNS)
+        units = snapshot['units']
+        for offset in range(0, len(units), columns):
+            unit_id, x, y, player_num, cur_speed, max_speed, is_speed_up = units[offset:offset + columns]
+            if unit_id != len(self._units):
+                raise Exception('Повреждено сохранение: неверный номер рабочего')
+            unit = Unit((x, y), max_speed, self._players[player_num], unit_id)
+            unit.cur_speed = cur_speed
+            unit.is_speed_up = bool(is_speed_up)
+            self._units.append(unit)
+            self._board.get_field((x, y)).add_unit(unit)
+        self.unit_count = snapshot['unit_count']
+        self.turn_number = snapshot['turn_number']
+
     def get_bases_coord(self):
         w = self._board.size[0] - 1
         h = self._board.size[1] - 1
-        return ((0, h // 2), (0, h // 2 + 1)), \
-               ((w, h // 2 + 1), (w, h // 2)), \
-               ((w // 2 + 1, 0), (w // 2, 0)), \
-               ((w // 2, h), (w // 2 + 1, h))
+        bases = ((0, h // 2), (0, h // 2 + 1)), \
+                ((w, h // 2 + 1), (w, h // 2)), \
+                ((w // 2 + 1, 0), (w // 2, 0)), \
+                ((w // 2, h), (w // 2 + 1, h))
+        return tuple(bases[seat] for seat in self.seats)
 
     def next_turn(self):
         self.turn_number += 1
-        self._board.update(self.get_cur_player())
+        cur_player = self.get_cur_player()
+        resources = cur_player.resources[:]
+        positions = sorted(set(tuple(unit.pos) for unit in self._units if unit.player == cur_player),
+                           key=lambda pos: (pos[1], pos[0]))
+        changed = self._board.update(cur_player, positions)
+        self._legal_moves.clear()
+        if self.fog is not None:
+            for pos, old_type in changed:
+                if self._board.get_field(pos).type == FieldTypes.TUNNEL:
+                    self.fog.on_tunnel_created(pos)
+        if self.stats is not None:
+            self.stats.on_turn(self, changed)
+        player_num = self.get_player_num(cur_player)
+        for pos in positions:
+            field = self._board.get_field(pos)
+            self.notify(FieldChanged(pos, field.type, field.cur_health))
+        if resources != cur_player.resources:
+            self.notify(ResourcesChanged(player_num, tuple(cur_player.resources)))
+        self.notify(TurnChanged(self.turn_number, player_num))
 
     def is_game_over(self):
         for y in range(self._board.size[1]):
@@ -202,6 +341,10 @@ class Game(object):
             self._units.append(Unit(field_pos, self.MAX_UNIT_SPEED, self.get_cur_player(), self.unit_count))
             field.add_unit(self._units[len(self._units) - 1])
             self.unit_count += 1
+            self._invalidate_moves_around(field_pos)
+            if self.fog is not None:
+                self.fog.add_unit(self._units[len(self._units) - 1])
+            self.notify(UnitAdded(self.unit_count - 1, tuple(field_pos), self.get_player_num(self.get_cur_player())))
             return True
         return False
 
@@ -211,6 +354,7 @@ class Game(object):
             if not unit.is_speed_up:
                 if self.get_cur_player().resources[ResourcesTypes.OIL] >= self.SPEED_UP_COST:
                     unit.speed_up()
+                    self._legal_moves.pop(unit_id, None)
                     return True
         return False
 
@@ -219,6 +363,8 @@ class Game(object):
         if self.get_cur_player().resources[ResourcesTypes.GOLD] >= self.UNIT_COST and \
                 len(self.get_field_by_coord(base_pos).units) < self.MAX_UNITS_ON_FIELD:
             self.get_cur_player().resources[ResourcesTypes.GOLD] -= self.UNIT_COST
+            self.notify(ResourcesChanged(self.get_player_num(self.get_cur_player()),
+                                         tuple(self.get_cur_player().resources)))
             self.add_unit(base_pos)
             return True
         return False
@@ -240,11 +386,143 @@ class Game(object):
             new_field = self.get_field_by_coord(new_pos)
             if old_field is not None and new_field is not None:
                 if unit.is_can_move(new_pos) and self.is_unit_can_move(unit_id, new_pos):
+                    old_pos = unit.pos
                     unit.move(new_pos)
                     new_field.add_unit(old_field.pop_unit(unit))
+                    self._invalidate_moves_around(old_pos)
+                    self._invalidate_moves_around(new_pos)
+                    if self.fog is not None:
+                        self.fog.move_unit(unit, old_pos)
+                    self.notify(UnitMoved(unit_id, old_pos, new_pos))
                     return True
         return False
 
+    def apply_actions(self, actions):
+        # Applies actions of the current player in order with the rules of move_unit, buy_unit and
+        # speed_up_unit: (MOVE, unit_id, pos), (BUY,), (SPEED_UP, unit_id). Field capacity is checked against
+        # the moves already applied in the batch. Units and fields are resolved once per action, the legal moves
+        # cache and the fog are updated once for the whole batch, and the events are sent after it.
+        # Malformed actions are rejected before anything is applied, so a batch is never left half done.
+        for action in actions:
+            if not self.is_valid_action(action):
+                raise Exception('Неверное действие: ' + str(action))
+        results = array('b', bytes(len(actions)))
+        cur_player = self.get_cur_player()
+        player_num = self.get_player_num(cur_player)
+        resources = cur_player.resources
+        board = self._board
+        width, height = board.size
+        types = board.types
+        units = self._units
+        base_pos = self.get_bases_coord()[player_num][0]
+        moved = dict()
+        added = []
+        touched = set()
+        events = []
+        for i, action in enumerate(actions):
+            action_type = action[0]
+            if action_type == ActionTypes.MOVE:
+                unit_id, new_pos = action[1], action[2]
+                if not 0 <= unit_id < len(units) or not (0 <= new_pos[0] < width and 0 <= new_pos[1] < height):
+                    continue
+                unit = units[unit_id]
+                old_pos = unit.pos
+                if unit.player != cur_player or get_dist(old_pos, new_pos) > unit.cur_speed:
+                    continue
+                new_field = board.get_field(new_pos)
+                if len(new_field.units) >= self.MAX_UNITS_ON_FIELD:
+                    continue
+                if types[old_pos[1] * width + old_pos[0]] != FieldTypes.TUNNEL and \
+                        types[new_pos[1] * width + new_pos[0]] != FieldTypes.TUNNEL:
+                    continue
+                unit.move(new_pos)
+                new_field.add_unit(board.get_field(old_pos).pop_unit(unit))
+                moved.setdefault(unit, old_pos)
+                touched.add(tuple(old_pos))
+                touched.add(tuple(new_pos))
+                events.append(UnitMoved(unit_id, old_pos, new_pos))
+            elif action_type == ActionTypes.BUY:
+                base_field = board.get_field(base_pos)
+                if resources[ResourcesTypes.GOLD] < self.UNIT_COST or \
+                        len(base_field.units) >= self.MAX_UNITS_ON_FIELD:
+                    continue
+                resources[ResourcesTypes.GOLD] -= self.UNIT_COST
+                unit = Unit(base_pos, self.MAX_UNIT_SPEED, cur_player, self.unit_count)
+                units.append(unit)
+                base_field.add_unit(unit)
+                self.unit_count += 1
+                added.append(unit)
+                touched.add(tuple(base_pos))
+                events.append(ResourcesChanged(player_num, tuple(resources)))
+                events.append(UnitAdded(unit.id, tuple(base_pos), player_num))
+            else:
+                unit_id = action[1]
+                if not 0 <= unit_id < len(units) or units[unit_id].is_speed_up or \
+                        resources[ResourcesTypes.OIL] < self.SPEED_UP_COST:
+                    continue
+                units[unit_id].speed_up()
+                self._legal_moves.pop(unit_id, None)
+            results[i] = 1
+        if len(touched) * 5 >= len(self._legal_moves):
+            # dropping the cache is cheaper than looking up the neighbourhood of every touched field
+            self._legal_moves.clear()
+        else:
+            for pos in touched:
+                self._invalidate_moves_around(pos)
+        if self.fog is not None:
+            # visibility only counts units, so a unit moved several times is moved once from where it started
+            for unit in added:
+                self.fog.add_unit(unit)
+            for unit, old_pos in moved.items():
+                if unit.id < len(units) - len(added):
+                    self.fog.move_unit(unit, old_pos)
+        for event in events:
+            self.notify(event)
+        return results
+
+    def is_valid_action(self, action):
+        if not isinstance(action, (tuple, list)) or len(action) == 0 or \
+                self.ACTION_SIZES.get(action[0]) != len(action):
+            return False
+        if action[0] == ActionTypes.BUY:
+            return True
+        if not isinstance(action[1], int):
+            return False
+        if action[0] == ActionTypes.MOVE:
+            pos = action[2]
+            return isinstance(pos, (tuple, list)) and len(pos) == 2 and all(isinstance(c, int) for c in pos)
+        return True
+
+    def get_legal_moves(self, unit_id):
+        moves = self._legal_moves.get(unit_id)
+        if moves is None:
+            unit = self.get_unit_by_id(unit_id)
+            moves = frozenset(
+                new_pos for new_pos in ((unit.pos[0] - 1, unit.pos[1]), (unit.pos[0] + 1, unit.pos[1]),
+                                        (unit.pos[0], unit.pos[1] - 1), (unit.pos[0], unit.pos[1] + 1))
+                if self._board.get_field(new_pos) is not None and unit.is_can_move(new_pos) and
+                self.is_unit_can_move(unit_id, new_pos))
+            self._legal_moves[unit_id] = moves
+        return moves
+
+    def get_resource_distance(self, pos: [int, int], res_name='diamond'):
+        return self._board.distances.get_distance(res_name, pos)
+
+    def get_nearest_resource(self, pos: [int, int], res_name='diamond'):
+        return self._board.distances.get_nearest(res_name, pos)
+
+    def _invalidate_moves_around(self, pos: [int, int]):
+        # a unit's moves depend on its own field and the occupancy of its neighbours
+        for x, y in ((pos[0], pos[1]), (pos[0] - 1, pos[1]), (pos[0] + 1, pos[1]),
+                     (pos[0], pos[1] - 1), (pos[0], pos[1] + 1)):
+            for unit in self.get_units_on_field((x, y)):
+                self._legal_moves.pop(unit.id, None)
+
+    def is_visible(self, player: Player, pos: [int, int]):
+        if self.fog is None:
+            return True
+        return self.fog.is_visible(self.get_player_num(player), pos)
+
     def get_field_by_coord(self, pos: [int, int]) -> Field or None:
         return self._board.get_field(pos)
 
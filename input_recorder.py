@@ -0,0 +1,97 @@
+import json
+import random
+import pygame
+
+RECORDED_EVENTS = {
+    pygame.QUIT: (),
+    pygame.KEYDOWN: ('key',),
+    pygame.MOUSEBUTTONDOWN: ('pos', 'button', 'mods'),
+    pygame.MOUSEBUTTONUP: ('pos', 'button'),
+    pygame.MOUSEMOTION: ('pos',),
+    pygame.MOUSEWHEEL: ('y',),
+}
+
+EVENT_NAMES = {event_type: pygame.event.event_name(event_type) for event_type in RECORDED_EVENTS}
+EVENT_TYPES = {name: event_type for event_type, name in EVENT_NAMES.items()}
+
+
+def event_to_dict(event):
+    res = {'type': EVENT_NAMES[event.type]}
+    for attr in RECORDED_EVENTS[event.type]:
+        if attr == 'mods' and not hasattr(event, attr):
+            res[attr] = pygame.key.get_mods()
+        else:
+            value = getattr(event, attr)
+            res[attr] = list(value) if isinstance(value, tuple) else value
+    return res
+
+
+def dict_to_event(data):
+    attrs = {key: tuple(value) if isinstance(value, list) else value for key, value in data.items() if key != 'type'}
+    return pygame.event.Event(EVENT_TYPES[data['type']], attrs)
+
+
+class InputRecorder:
+    VERSION = 1
+
+    def __init__(self, file_name, seed=None):
+        self.file = open(file_name, 'w', encoding='utf-8')
+        self.frame = 0
+        self.time = 0
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        random.seed(self.seed)
+        self._write({'version': self.VERSION, 'seed': self.seed})
+
+    def _write(self, data):
+        self.file.write(json.dumps(data, ensure_ascii=False) + '\n')
+
+    def get_events(self, delta_time=0):
+        events = [event for event in pygame.event.get() if event.type in RECORDED_EVENTS]
+        self.time += delta_time
+        if len(events) != 0:
+            self._write({
+                'frame': self.frame,
+                'time': round(self.time, 6),
+                'events': [event_to_dict(event) for event in events]
+            })
+        self.frame += 1
+        return events
+
+    def close(self):
+        self._write({'frame': self.frame, 'time': round(self.time, 6), 'events': [], 'end': True})
+        self.file.close()
+
+
+class InputPlayer:
+    DELTA_TIME = 1 / 60
+
+    def __init__(self, file_name, delta_time=DELTA_TIME):
+        self.delta_time = delta_time
+        self.frame = 0
+        self.frames = dict()
+        self.last_frame = 0
+        with open(file_name, encoding='utf-8') as data:
+            header = json.loads(data.readline())
+            if header.get('version') != InputRecorder.VERSION:
+                raise Exception(f'Неподдерживаемая версия записи {header.get("version")}')
+            self.seed = header['seed']
+            for line in data:
+                record = json.loads(line)
+                self.frames[record['frame']] = [dict_to_event(event) for event in record['events']]
+                self.last_frame = max(self.last_frame, record['frame'])
+        random.seed(self.seed)
+
+    def is_finished(self):
+        return self.frame > self.last_frame
+
+    def get_events(self, delta_time=0):
+        # live input is dropped so the recording stays deterministic, only closing the window is kept
+        events = [event for event in pygame.event.get() if event.type == pygame.QUIT]
+        events.extend(self.frames.get(self.frame, []))
+        self.frame += 1
+        if self.is_finished():
+            events.append(pygame.event.Event(pygame.QUIT))
+        return events
+
+    def close(self):
+        pass
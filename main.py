@@ -1,8 +1,18 @@
+import argparse
+import time
 import pygame
-from game import Game, Unit, Field, Board, ResourcesTypes, get_dist
+from collections import OrderedDict
+from bot import BotController, BotActions
+from autosave import Autosaver, load_snapshot
+from events import FieldChanged, UnitMoved, UnitAdded, ResourcesChanged, TurnChanged
+from frame_recorder import FrameRecorder
+from game import Game, Unit, Board, ResourcesTypes, ActionTypes
 from pygame.sprite import Group, Sprite
 from pygame.rect import Rect
-from texture_loader import GROUNDS_TEXTURES, WORKERS_TEXTURES, CURSOR_TEXTURES
+from input_recorder import InputRecorder, InputPlayer
+from profiler import PROFILER
+from texture_loader import GROUNDS_TEXTURES, WORKERS_TEXTURES, WORKERS_BACKLIGHTING_TEXTURES, CURSOR_TEXTURES, \
+    SCALED_TEXTURES
 
 DISPLAY_SIZE = DISPLAY_WIDTH, DISPLAY_HEIGHT = 1280, 720
 PLAYERS_NAMES = ['Игрок1', 'Игрок2', 'Игрок3', 'Игрок4']
@@ -12,6 +22,35 @@ def is_point_in_rect(point: [int, int], rect: Rect):
     return rect.x <= point[0] <= rect.x + rect.width and rect.y <= point[1] <= rect.y + rect.height
 
 
+class FontCache:
+    TEXT_CACHE_SIZE = 512
+
+    def __init__(self):
+        self._fonts = dict()
+        self._texts = OrderedDict()
+
+    def get_font(self, family, size, bold=False):
+        key = (family, size, bold)
+        font = self._fonts.get(key)
+        if font is None:
+            font = self._fonts[key] = pygame.font.SysFont(family, size, bold)
+        return font
+
+    def render(self, font, text, color):
+        key = (font, text, tuple(color))
+        surface = self._texts.get(key)
+        if surface is None:
+            surface = self._texts[key] = font.render(text, True, color)
+            if len(self._texts) > self.TEXT_CACHE_SIZE:
+                self._texts.popitem(last=False)
+        else:
+            self._texts.move_to_end(key)
+        return surface
+
+
+FONTS = FontCache()
+
+
 class LayerSprite(Sprite):
     def __init__(self, layer_num):
         super().__init__()
@@ -26,32 +65,51 @@ class LayerSprite(Sprite):
         super().update(*args, **kwargs)
 
 
-class AnimatedSprite(LayerSprite):
+class AnimationClock:
     FRAME_DURATION = 0.1
 
+    def __init__(self):
+        self.time = 0
+        self.tick = 0
+        self._frames = dict()
+
+    def update(self, delta_time: float):
+        self.time += delta_time
+        tick = int(self.time / self.FRAME_DURATION)
+        if tick != self.tick:
+            self.tick = tick
+            self._frames.clear()
+            return True
+        return False
+
+    def get_frame(self, frame_count: int, animation_delta: int = 1):
+        key = (frame_count, animation_delta)
+        frame = self._frames.get(key)
+        if frame is None:
+            frame = self._frames[key] = (self.tick * animation_delta) % frame_count
+        return frame
+
+
+ANIMATION_CLOCK = AnimationClock()
+
+
+class AnimatedSprite(LayerSprite):
     def __init__(self, layer_num, frames):
         super().__init__(layer_num)
         self.animation_delta = 1
         self.frames = frames
-        self.cur_frame_time = 0
-        self.cur_frame_x = 0
         self.cur_frame_y = 0
-        self.image = self.frames[self.cur_frame_y][self.cur_frame_y]
 
-    def update(self, *args, **kwargs):
-        self.play_anim(kwargs['delta_time'])
-        super().update(*args, **kwargs)
-
-    def play_anim(self, delta_time: float):
-        self.cur_frame_time += delta_time
-        if self.cur_frame_time >= self.FRAME_DURATION:
-            self.cur_frame_time = 0
-            self.cur_frame_x = (self.cur_frame_x + self.animation_delta) % len(self.frames[self.cur_frame_y])
-            self.image = self.frames[self.cur_frame_y][self.cur_frame_x]
+    @property
+    def image(self):
+        row = self.frames[self.cur_frame_y]
+        return row[ANIMATION_CLOCK.get_frame(len(row), self.animation_delta)]
 
     def set_frame_y(self, y):
         self.cur_frame_y = y
-        self.cur_frame_x = 0
+
+    def set_frames(self, frames):
+        self.frames = frames
 
 
 class UnitSprite(AnimatedSprite):
@@ -64,20 +122,14 @@ class UnitSprite(AnimatedSprite):
 
     def __init__(self, player_num, unit: Unit, pos):
         self.unit = unit
-        super().__init__(GameLayerController.UNIT_LAYER,
-                         WORKERS_TEXTURES[player_num].copy())
+        self.player_num = player_num
+        super().__init__(GameLayerController.UNIT_LAYER, WORKERS_TEXTURES[player_num])
         self.rect = Rect(pos, (64, 64))
         self.toward_point = Rect(pos, (64, 64))
         self.delta_move = (0, 0)
         self.set_animation(self.ANIMATION_STAY)
 
     def update(self, *args, **kwargs):
-        key_controller = kwargs['key_controller']
-        if key_controller.is_click_on(self):
-            for sprite in self.groups()[0]:
-                sprite.is_selected = False
-            self.is_selected = True
-            key_controller.mouse_down_button = None
         # camera = kwargs['camera']
         # camera.apply(self.toward_point)
         # d_time = kwargs['delta_time']
@@ -89,50 +141,167 @@ class UnitSprite(AnimatedSprite):
         #     self.rect.x += self.delta_move[0]
         #     self.rect.y += self.delta_move[1]
         super().update(*args, **kwargs)
-        self.set_animation(self.cur_frame_y)
 
     def set_animation(self, animation_line: int = ANIMATION_STAY):
-        d = len(self.frames) // 2
-        if animation_line % d == self.ANIMATION_MOVE:
+        if animation_line == self.ANIMATION_MOVE:
             self.animation_delta = -1
         else:
             self.animation_delta = 1
-        animation_line %= d
-        animation_line += d if self.is_selected else 0
-        if animation_line % d == self.cur_frame_y % d:
-            self.cur_frame_y = animation_line
-        else:
-            self.set_frame_y(animation_line)
+        self.set_frame_y(animation_line)
+
+
+class UnitHighlightSprite(LayerSprite):
+    def __init__(self, unit_sprite: UnitSprite, frames):
+        super().__init__(GameLayerController.UNIT_UNDER_LAYER)
+        self.unit_sprite = unit_sprite
+        self.frames = frames
+        self.rect = unit_sprite.rect
+        self.is_dragable = False
+
+    @property
+    def image(self):
+        row = self.frames[self.unit_sprite.cur_frame_y]
+        return row[ANIMATION_CLOCK.get_frame(len(row), self.unit_sprite.animation_delta)]
+
 
+class MoveHighlightSprite(LayerSprite):
+    def __init__(self, image, pos):
+        super().__init__(GameLayerController.GROUND_UNDER_LAYER)
+        self.image = image
+        self.rect = Rect(pos, image.get_size())
 
-class FieldSprite(LayerSprite):
-    def __init__(self, field: Field, pos):
+
+class TerrainChunk(LayerSprite):
+    SIZE = 8
+    TEXT_COLOR = pygame.color.Color('gray')
+    FOG_COLOR = pygame.color.Color('black')
+    MIN_TEXT_ZOOM = 0.5
+
+    def __init__(self, board: Board, chunk_pos: [int, int], zoom=1, is_visible=None):
         super().__init__(GameLayerController.GROUND_LAYER)
-        self.field = field
-        self.rect = Rect(pos, (94, 94))
-        self.init()
+        self.board = board
+        self.is_visible = is_visible
+        self.chunk_pos = chunk_pos
+        self.first_field = chunk_pos[0] * self.SIZE, chunk_pos[1] * self.SIZE
+        self.fields_size = min(self.SIZE, board.size[0] - self.first_field[0]), \
+                           min(self.SIZE, board.size[1] - self.first_field[1])
+        self.is_dragable = False
+        self.image = None
+        self._baked = dict()
+        self.set_zoom(zoom)
+
+    def set_zoom(self, zoom):
+        self.release()
+        self.zoom = zoom
+        self.field_size = Camera.scale_value(GameScene.FIELD_SIZE, zoom)
+        self.textures = SCALED_TEXTURES.get_textures(GROUNDS_TEXTURES, zoom)
+        self.rect = Rect((self.first_field[0] * self.field_size, self.first_field[1] * self.field_size),
+                         (self.fields_size[0] * self.field_size, self.fields_size[1] * self.field_size))
+
+    def is_baked(self):
+        return self.image is not None
+
+    def bake(self):
+        self.image = pygame.surface.Surface(self.rect.size).convert()
+        self._baked.clear()
+        self.refresh()
+
+    def release(self):
+        self.image = None
+        self._baked.clear()
+
+    def refresh(self):
+        for y in range(self.first_field[1], self.first_field[1] + self.fields_size[1]):
+            for x in range(self.first_field[0], self.first_field[0] + self.fields_size[0]):
+                self.refresh_field((x, y))
+
+    def refresh_field(self, field_pos: [int, int]):
+        field = self.board.get_field(field_pos)
+        is_visible = self.is_visible is None or self.is_visible(field_pos)
+        state = (field.type, field.cur_health) if is_visible else None
+        if field_pos in self._baked and self._baked[field_pos] == state:
+            return
+        self._baked[field_pos] = state
+        dest = (field_pos[0] - self.first_field[0]) * self.field_size, \
+               (field_pos[1] - self.first_field[1]) * self.field_size
+        if not is_visible:
+            self.image.fill(self.FOG_COLOR, Rect(dest, (self.field_size, self.field_size)))
+            return
+        self.image.blit(self.textures[field.type], dest)
+        if self.zoom < self.MIN_TEXT_ZOOM:
+            return
+        font_sur = FONTS.render(FONTS.get_font('Arial', 14), str(field.cur_health), self.TEXT_COLOR)
+        self.image.blit(font_sur, dest)
+
+
+class Terrain:
+    KEEP_BAKED_MARGIN = 1
+
+    def __init__(self, board: Board, layer: Group, view_size: [int, int], zoom=1, is_visible=None):
+        self.board = board
+        self.layer = layer
+        self.view_size = view_size
+        self.zoom = zoom
+        self.chunks = dict()
+        for y in range((board.size[1] + TerrainChunk.SIZE - 1) // TerrainChunk.SIZE):
+            for x in range((board.size[0] + TerrainChunk.SIZE - 1) // TerrainChunk.SIZE):
+                self.chunks[(x, y)] = TerrainChunk(board, (x, y), zoom, is_visible)
+
+    def set_zoom(self, zoom):
+        self.zoom = zoom
+        for chunk in self.chunks.values():
+            chunk.set_zoom(zoom)
+
+    def get_chunk(self, field_pos: [int, int]):
+        return self.chunks.get((field_pos[0] // TerrainChunk.SIZE, field_pos[1] // TerrainChunk.SIZE))
+
+    def get_chunks_range(self, camera_pos: [int, int], margin=0):
+        chunk_px = TerrainChunk.SIZE * Camera.scale_value(GameScene.FIELD_SIZE, self.zoom)
+        return range(-camera_pos[0] // chunk_px - margin, (self.view_size[0] - camera_pos[0]) // chunk_px + 1 + margin), \
+               range(-camera_pos[1] // chunk_px - margin, (self.view_size[1] - camera_pos[1]) // chunk_px + 1 + margin)
+
+    def update(self, camera_pos: [int, int]):
+        xs, ys = self.get_chunks_range(camera_pos, self.KEEP_BAKED_MARGIN)
+        for chunk in self.chunks.values():
+            if chunk.is_baked() and (chunk.chunk_pos[0] not in xs or chunk.chunk_pos[1] not in ys):
+                chunk.release()
+        xs, ys = self.get_chunks_range(camera_pos)
+        self.layer.empty()
+        for y in ys:
+            for x in xs:
+                chunk = self.chunks.get((x, y))
+                if chunk is None:
+                    continue
+                if not chunk.is_baked():
+                    chunk.bake()
+                chunk.rect.x = chunk.first_field[0] * chunk.field_size + camera_pos[0]
+                chunk.rect.y = chunk.first_field[1] * chunk.field_size + camera_pos[1]
+                self.layer.add(chunk)
 
-    def init(self):
-        self.image = GROUNDS_TEXTURES[self.field.type].copy()
-        text = str(self.field.cur_health)
-        font_sur = pygame.font.SysFont('Arial', 14, False). \
-            render(text, True, pygame.color.Color('gray'))
-        self.image.blit(font_sur, (0, 0))
+    def redraw(self):
+        for chunk in self.chunks.values():
+            if chunk.is_baked():
+                chunk.refresh()
 
-    def update(self, *args, **kwargs):
-        super().update(*args, **kwargs)
+    def redraw_field(self, field_pos: [int, int]):
+        chunk = self.get_chunk(field_pos)
+        if chunk is not None and chunk.is_baked():
+            chunk.refresh_field(tuple(field_pos))
 
 
 class LayerController:
     def __init__(self):
         self.layers = []
+        self.layer_names = []
+        self.update_time = 0
 
     def add_sprite(self, sprite: LayerSprite):
         if sprite.layer_num < 0 or len(self.layers) <= sprite.layer_num:
             raise Exception('Недопустимый номер слоя')
         self.layers[sprite.layer_num].add(sprite)
 
-    def add_layer(self):
+    def add_layer(self, name=None):
+        self.layer_names.append(name if name is not None else 'layer ' + str(len(self.layers)))
         self.layers.append(Group())
 
     def get_layer_num(self, sprite: LayerSprite):
@@ -142,12 +311,30 @@ class LayerController:
         return None
 
     def update(self, *args, **kwargs):
+        self.update_time = 0
         for i in range(len(self.layers) - 1, -1, -1):
+            start = PROFILER.start()
             self.layers[i].update(*args, **kwargs)
+            self.update_time += PROFILER.stop(self.layer_names[i] + ' update', start)
 
     def draw(self, surface):
-        for group in self.layers:
-            group.draw(surface)
+        # sprites of all layers go to the surface in one blits call, the list keeps the layer order
+        # and off-screen sprites are left out of it
+        surface_rect = surface.get_rect()
+        batch = []
+        sprites_count = 0
+        for i in range(len(self.layers)):
+            start = PROFILER.start()
+            sprites = self.layers[i].sprites()
+            sprites_count += len(sprites)
+            batch.extend((sprite.image, sprite.rect) for sprite in sprites if surface_rect.colliderect(sprite.rect))
+            PROFILER.stop(self.layer_names[i] + ' draw', start)
+            PROFILER.count(self.layer_names[i] + ' sprites', len(sprites))
+        start = PROFILER.start()
+        surface.blits(batch, doreturn=False)
+        PROFILER.stop('blits', start)
+        PROFILER.count('blits', len(batch))
+        PROFILER.count('culled', sprites_count - len(batch))
 
 
 class GameLayerController(LayerController):
@@ -159,34 +346,56 @@ class GameLayerController(LayerController):
     GUI_LAYER = 5
     CURSOR_LAYER = 6
 
+    LAYER_NAMES = ['ground', 'ground under', 'unit under', 'unit', 'unit above', 'gui', 'cursor']
+
     def __init__(self):
         super().__init__()
-        [self.add_layer() for _ in range(7)]
+        [self.add_layer(name) for name in self.LAYER_NAMES]
 
 
 class KeyController:
-    def __init__(self):
+    def __init__(self, event_source=None):
+        self.event_source = event_source
         self.is_mouse_down = False
         self.mouse_down_button = None
+        self.mouse_down_mods = 0
         self.mouse_down_pos = None
         self.mouse_up_pos = None
         self.mouse_pos = None
         self.pre_mouse_pos = None
 
+        self.wheel = 0
+        self.has_events = False
+
         self.is_key_pressed = False
         self.last_pressed_key = None
 
+        self.system_keys = set()
+        self.pressed_system_keys = []
+
         self.is_quit = False
 
     def update(self, *args, **kwargs):
         self.is_key_pressed = False
         self.pre_mouse_pos = self.mouse_pos
+        self.wheel = 0
+        self.has_events = False
+        self.pressed_system_keys = []
 
-        for event in pygame.event.get():
+        if self.event_source is not None:
+            events = self.event_source.get_events(kwargs.get('delta_time', 0))
+        else:
+            events = pygame.event.get()
+        self.has_events = len(events) != 0
+
+        for event in events:
             if event.type == pygame.QUIT:
                 self.is_quit = True
 
             if event.type == pygame.KEYDOWN:
+                if event.key in self.system_keys:
+                    self.pressed_system_keys.append(event.key)
+                    continue
                 self.last_pressed_key = event.key
                 self.is_key_pressed = True
 
@@ -194,6 +403,7 @@ class KeyController:
                 self.is_mouse_down = True
                 self.mouse_down_pos = event.pos
                 self.mouse_down_button = event.button
+                self.mouse_down_mods = event.mods if hasattr(event, 'mods') else pygame.key.get_mods()
 
             if event.type == pygame.MOUSEBUTTONUP:
                 self.is_mouse_down = False
@@ -203,12 +413,20 @@ class KeyController:
             if event.type == pygame.MOUSEMOTION:
                 self.mouse_pos = event.pos
 
+            if event.type == pygame.MOUSEWHEEL:
+                self.wheel += event.y
+
+    def is_click(self):
+        return self.mouse_down_button == pygame.BUTTON_LEFT and not self.is_mouse_down
+
     def is_click_on(self, sprite: LayerSprite):
-        return self.mouse_down_button == pygame.BUTTON_LEFT and \
-               not self.is_mouse_down and \
+        return self.is_click() and \
                is_point_in_rect(self.mouse_down_pos, sprite.rect) and \
                is_point_in_rect(self.mouse_up_pos, sprite.rect)
 
+    def is_shift_click(self):
+        return self.is_click() and bool(self.mouse_down_mods & pygame.KMOD_SHIFT)
+
     def is_drag(self):
         return self.is_mouse_down and self.mouse_down_button == pygame.BUTTON_RIGHT
 
@@ -233,21 +451,55 @@ class Scene:
     def add(self, sprite):
         self.layer_controller.add_sprite(sprite)
 
-    def draw(self, screen):
+    def draw(self, screen, lag=0):
         self.layer_controller.draw(screen)
 
     def update(self, *args, **kwargs):
         self.layer_controller.update(*args, **kwargs)
 
+    def is_animating(self):
+        return False
+
     @property
     def select(self):
         return self._select
 
 
 class Camera:
+    ZOOM_LEVELS = (0.25, 0.5, 0.75, 1, 1.5)
+    DEFAULT_ZOOM_NUM = 3
+
     def __init__(self, pos: [int, int] = (0, 0)):
         self.pos = pos
         self.delta = (0, 0)
+        self.zoom_num = self.DEFAULT_ZOOM_NUM
+
+    @property
+    def zoom(self):
+        return self.ZOOM_LEVELS[self.zoom_num]
+
+    @staticmethod
+    def scale_value(value, zoom):
+        return max(1, round(value * zoom))
+
+    def scale(self, value):
+        return self.scale_value(value, self.zoom)
+
+    def to_screen(self, world_pos: [float, float]):
+        return round(world_pos[0] * self.zoom + self.pos[0]), round(world_pos[1] * self.zoom + self.pos[1])
+
+    def to_world(self, screen_pos: [int, int]):
+        return (screen_pos[0] - self.pos[0]) / self.zoom, (screen_pos[1] - self.pos[1]) / self.zoom
+
+    def set_zoom(self, zoom_num, center: [int, int]):
+        zoom_num = min(max(zoom_num, 0), len(self.ZOOM_LEVELS) - 1)
+        if zoom_num == self.zoom_num:
+            return False
+        ratio = self.ZOOM_LEVELS[zoom_num] / self.zoom
+        self.pos = round(center[0] - (center[0] - self.pos[0]) * ratio), \
+                   round(center[1] - (center[1] - self.pos[1]) * ratio)
+        self.zoom_num = zoom_num
+        return True
 
     def apply(self, rect: Rect):
         rect.x += self.delta[0]
@@ -258,20 +510,94 @@ class Camera:
         self.pos = (self.pos[0] + self.delta[0], self.pos[1] + self.delta[1])
 
 
+class Selection:
+    def __init__(self):
+        self.sprites = dict()
+        self.primary = None
+        self._listeners = []
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def notify(self):
+        for listener in self._listeners:
+            listener(self)
+
+    def select(self, sprite: LayerSprite, add=False):
+        if not add:
+            for selected in list(self.sprites.values()):
+                self._set_selected(selected, False)
+            self.sprites.clear()
+        if add and sprite.unit.id in self.sprites:
+            self._set_selected(self.sprites.pop(sprite.unit.id), False)
+            self.primary = next(reversed(list(self.sprites.values())), None)
+        else:
+            self.sprites[sprite.unit.id] = sprite
+            self._set_selected(sprite, True)
+            self.primary = sprite
+        self.notify()
+
+    def remove(self, sprite: LayerSprite):
+        if sprite.unit.id not in self.sprites:
+            return
+        self._set_selected(self.sprites.pop(sprite.unit.id), False)
+        if self.primary is sprite:
+            self.primary = next(reversed(list(self.sprites.values())), None)
+        self.notify()
+
+    def clear(self):
+        for selected in self.sprites.values():
+            self._set_selected(selected, False)
+        self.sprites.clear()
+        self.primary = None
+        self.notify()
+
+    def is_selected(self, sprite: LayerSprite):
+        return sprite.unit.id in self.sprites
+
+    def __iter__(self):
+        return iter(list(self.sprites.values()))
+
+    def __len__(self):
+        return len(self.sprites)
+
+    @staticmethod
+    def _set_selected(sprite, value):
+        sprite.is_selected = value
+
+
 class Label:
     BACK_COLOR = pygame.color.Color(40, 40, 40)
     TEXT_COLOR = pygame.color.Color(255, 255, 255)
     MARGIN = 5
 
-    def __init__(self, size: [int, int], text='', font_size=30, color=TEXT_COLOR):
+    def __init__(self, size: [int, int], text='', font_size=30, color=TEXT_COLOR, pos: [int, int] = (0, 0)):
         self.size = size
         self.text = text
         self.color = color
-        self.font = pygame.font.SysFont('Comic Sans MS', font_size)
+        self.pos = pos
+        self.font = FONTS.get_font('Comic Sans MS', font_size)
+        self._drawn_state = None
+
+    def set_text(self, text, color=None):
+        self.text = text
+        if color is not None:
+            self.color = color
+
+    def get_state(self):
+        return self.text, tuple(self.color)
+
+    def is_dirty(self):
+        return self._drawn_state != self.get_state()
 
-    def draw(self, surface, pos):
+    def get_rect(self):
+        return Rect(self.pos, self.size)
+
+    def draw(self, surface, pos=None):
+        pos = self.pos if pos is None else pos
         surface.fill(self.BACK_COLOR, rect=Rect(pos, self.size))
-        surface.blit(self.font.render(self.text, True, self.color), (pos[0] + self.MARGIN, pos[1]))
+        surface.blit(FONTS.render(self.font, self.text, self.color), (pos[0] + self.MARGIN, pos[1]))
+        self._drawn_state = self.get_state()
 
 
 class Button:
@@ -287,18 +613,29 @@ class Button:
         self.text = text
         self.pos = pos
         self.checked = False
-        self.font = pygame.font.SysFont('Comic Sans MS', font_size)
+        self.font = FONTS.get_font('Comic Sans MS', font_size)
+        self._drawn_state = None
 
     def is_click(self, pos):
         return is_point_in_rect(pos, Rect(self.pos, self.size))
 
+    def get_state(self):
+        return self.text, self.checked
+
+    def is_dirty(self):
+        return self._drawn_state != self.get_state()
+
+    def get_rect(self):
+        return Rect(self.pos, self.size)
+
     def draw(self, surface):
+        self._drawn_state = self.get_state()
         surface.fill(self.BORDER_COLOR if not self.checked else self.CHECKED_COLOR,
                      rect=Rect(self.pos, self.size))
         surface.fill(self.BACK_COLOR,
                      rect=Rect((self.pos[0] + self.PADDING, self.pos[1] + self.PADDING),
                                (self.size[0] - self.PADDING * 2, self.size[1] - self.PADDING * 2)))
-        surface.blit(self.font.render(self.text, True, self.TEXT_COLOR), (self.pos[0] + self.MARGIN, self.pos[1]))
+        surface.blit(FONTS.render(self.font, self.text, self.TEXT_COLOR), (self.pos[0] + self.MARGIN, self.pos[1]))
 
 
 class Panel(LayerSprite):
@@ -323,109 +660,267 @@ class Panel(LayerSprite):
                                   0 + self.MARGIN,
                                   self.rect.width - self.MARGIN * 2,
                                   self.rect.height - self.MARGIN * 2))
-        self.set_player_label('Vania')
-        self.set_resources_labels((0, 0, 0))
-        self.set_unit_label()
         self.is_dragable = False
 
+        self.player_label = Label(size=(180, self.HEIGHT - 4 * self.MARGIN),
+                                  pos=(self.MARGIN * 2, self.MARGIN * 2))
+        self.resources_labels = [
+            Label(size=(220, self.HEIGHT - 4 * self.MARGIN),
+                  color=pygame.color.Color('Cyan'), pos=(190, self.MARGIN * 2)),
+            Label(size=(180, self.HEIGHT - 4 * self.MARGIN),
+                  color=pygame.color.Color('yellow'), pos=(420, self.MARGIN * 2)),
+            # oil PANEl
+            # Label(size=(150, self.HEIGHT - 4 * self.MARGIN), pos=(630, self.MARGIN * 2)),
+        ]
+        self.unit_label = Label(size=(230, self.HEIGHT - 4 * self.MARGIN), pos=(610, self.MARGIN * 2))
         self.buttons = [
             Button(size=(80, self.HEIGHT - 4 * self.MARGIN), text='идти', pos=(850, self.MARGIN * 2)),
             Button(size=(90, self.HEIGHT - 4 * self.MARGIN), text='выбор', pos=(940, self.MARGIN * 2)),
             Button(size=(100, self.HEIGHT - 4 * self.MARGIN), text='купить', pos=(1040, self.MARGIN * 2)),
             Button(size=(80, self.HEIGHT - 4 * self.MARGIN), text='след.', pos=(1150, self.MARGIN * 2))
         ]
-        for button in self.buttons:
-            button.draw(self.image)
+        self.widgets = [self.player_label, *self.resources_labels, self.unit_label, *self.buttons]
+
+        self.set_player_label('Vania')
+        self.set_resources_labels((0, 0, 0))
+        self.set_unit_label()
+        self.repaint()
 
     def check_button(self, num):
-        for button in self.buttons:
-            button.checked = False
-            button.draw(self.image)
-        self.buttons[num].checked = True
-        self.buttons[num].draw(self.image)
+        for i in range(len(self.buttons)):
+            self.buttons[i].checked = i == num
 
     def set_unit_label(self, unit: Unit = None):
         speed = None
         if unit is not None:
             speed = unit.cur_speed
-        Label(size=(230, self.HEIGHT - 4 * self.MARGIN),
-              text='Скорость: ' + str(speed)).draw(self.image, (610, self.MARGIN * 2))
+        self.unit_label.set_text('Скорость: ' + str(speed))
 
     def set_resources_labels(self, resources):
         resources = list(map(str, resources))
-        Label(size=(220, self.HEIGHT - 4 * self.MARGIN),
-              text=ResourcesTypes.VISIBLE_NAMES[0] + ': ' + resources[0],
-              color=pygame.color.Color('Cyan')). \
-            draw(self.image, (190, self.MARGIN * 2))
-        Label(size=(180, self.HEIGHT - 4 * self.MARGIN),
-              text=ResourcesTypes.VISIBLE_NAMES[1] + ': ' + resources[1],
-              color=pygame.color.Color('yellow')). \
-            draw(self.image, (420, self.MARGIN * 2))
-        # oil PANEl
-        # Label(size=(150, self.HEIGHT - 4 * self.MARGIN),
-        #       text=ResourcesTypes.NAMES[2] + ': ' + resources[2]).draw(self.image, (630, self.MARGIN * 2))
+        for i in range(len(self.resources_labels)):
+            self.resources_labels[i].set_text(ResourcesTypes.VISIBLE_NAMES[i] + ': ' + resources[i])
 
     def set_player_label(self, name, color=PLAYERS_COLORS[0]):
-        Label(size=(180, self.HEIGHT - 4 * self.MARGIN),
-              text=name, color=color).draw(self.image, (self.MARGIN * 2, self.MARGIN * 2))
+        self.player_label.set_text(name, color)
+
+    def repaint(self):
+        dirty_rects = []
+        for widget in self.widgets:
+            if widget.is_dirty():
+                widget.draw(self.image)
+                dirty_rects.append(widget.get_rect().move(self.rect.topleft))
+        return dirty_rects
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        dirty_rects = self.repaint()
+        if len(dirty_rects) != 0 and 'display' in kwargs:
+            kwargs['display'].add_dirty_rects(dirty_rects)
+
+
+class Minimap(LayerSprite):
+    MAX_SIZE = 200
+    MARGIN = 10
+    BORDER = 2
+    BORDER_COLOR = pygame.color.Color(120, 120, 120)
+    VIEW_COLOR = pygame.color.Color(255, 255, 255)
+    FOG_COLOR = bytes(3)
+
+    def __init__(self, game: Game, display_size: [int, int], player_num=0):
+        super().__init__(GameLayerController.GUI_LAYER)
+        self.game = game
+        self.board = game.get_board()
+        self.is_dragable = False
+        width, height = self.board.size
+        scale = self.MAX_SIZE / max(width, height)
+        self.map_size = max(1, round(width * scale)), max(1, round(height * scale))
+        self.rect = Rect((display_size[0] - self.map_size[0] - 2 * self.BORDER - self.MARGIN, self.MARGIN),
+                         (self.map_size[0] + 2 * self.BORDER, self.map_size[1] + 2 * self.BORDER))
+        self.image = pygame.surface.Surface(self.rect.size)
+        # one RGB pixel per cell, the surface shares the buffer so cells are written as plain bytes
+        self.ground_colors = [bytes(pygame.transform.average_color(texture)[:3]) for texture in GROUNDS_TEXTURES]
+        self.players_colors = [bytes(tuple(color)[:3]) for color in Panel.PLAYERS_COLORS]
+        self.channels = [bytes(self.ground_colors[i][channel] if i < len(self.ground_colors) else 0
+                               for i in range(256)) for channel in range(3)]
+        # with fog every player keeps its own picture, patched from the fog changes, so switching players
+        # does not rescan the board
+        self.buffers = dict()
+        self.surfaces = dict()
+        self.player_num = None
+        self.cells = None
+        self.scaled = None
+        self.view_rect = None
+        self._drawn_state = None
+        self.set_player(player_num)
+
+    def get_color(self, field_pos, i):
+        units = self.game.get_units_on_field(field_pos)
+        if len(units) != 0:
+            return self.players_colors[self.game.get_player_num(units[0].player)]
+        return self.ground_colors[self.board.types[i]]
+
+    def set_player(self, player_num):
+        if player_num not in self.buffers:
+            width, height = self.board.size
+            self.buffers[player_num] = bytearray(3 * width * height)
+            self.surfaces[player_num] = pygame.image.frombuffer(self.buffers[player_num], self.board.size, 'RGB')
+            self.rebuild(player_num)
+        self.player_num = player_num
+        self.cells = self.surfaces[player_num]
+        self.scaled = None
+
+    def rebuild(self, player_num):
+        buffer = self.buffers[player_num]
+        types = self.board.types.tobytes()
+        if self.game.fog is None:
+            for channel in range(3):
+                buffer[channel::3] = types.translate(self.channels[channel])
+        else:
+            buffer[:] = self.FOG_COLOR * (len(buffer) // 3)
+            for i in self.game.fog.get_visible_indices(player_num):
+                buffer[3 * i:3 * i + 3] = self.ground_colors[types[i]]
+        for unit in self.game.get_units():
+            self.paint_field(player_num, unit.pos)
+        self.scaled = None
+
+    def paint_field(self, player_num, field_pos: [int, int]):
+        i = field_pos[1] * self.board.size[0] + field_pos[0]
+        is_visible = self.game.fog is None or self.game.fog.is_visible(player_num, field_pos)
+        self.buffers[player_num][3 * i:3 * i + 3] = self.get_color(field_pos, i) if is_visible else self.FOG_COLOR
+
+    def refresh_field(self, field_pos: [int, int]):
+        for player_num in self.buffers:
+            self.paint_field(player_num, field_pos)
+        self.scaled = None
+
+    def refresh_fog(self, player_num, fields):
+        if player_num not in self.buffers or len(fields) == 0:
+            return
+        for field_pos in fields:
+            self.paint_field(player_num, field_pos)
+        if player_num == self.player_num:
+            self.scaled = None
+
+    def set_view(self, camera: Camera, view_size: [int, int]):
+        field_size = camera.scale(GameScene.FIELD_SIZE)
+        scale_x, scale_y = self.map_size[0] / self.board.size[0], self.map_size[1] / self.board.size[1]
+        view_rect = Rect(self.BORDER + round(-camera.pos[0] / field_size * scale_x),
+                         self.BORDER + round(-camera.pos[1] / field_size * scale_y),
+                         max(1, round(view_size[0] / field_size * scale_x)),
+                         max(1, round(view_size[1] / field_size * scale_y)))
+        self.view_rect = view_rect
+
+    def get_field_pos(self, screen_pos: [int, int]):
+        return (screen_pos[0] - self.rect.x - self.BORDER) * self.board.size[0] / self.map_size[0], \
+               (screen_pos[1] - self.rect.y - self.BORDER) * self.board.size[1] / self.map_size[1]
+
+    def get_state(self):
+        return self.scaled is not None, self.view_rect
+
+    def repaint(self):
+        if self.scaled is None:
+            self.scaled = pygame.transform.scale(self.cells, self.map_size)
+        self.image.fill(self.BORDER_COLOR)
+        self.image.blit(self.scaled, (self.BORDER, self.BORDER))
+        if self.view_rect is not None:
+            pygame.draw.rect(self.image, self.VIEW_COLOR, self.view_rect.clip(self.image.get_rect()), 1)
+        self._drawn_state = self.get_state()
 
     def update(self, *args, **kwargs):
         super().update(*args, **kwargs)
+        if self._drawn_state != self.get_state():
+            self.repaint()
+            if 'display' in kwargs:
+                kwargs['display'].add_dirty_rects([self.rect])
+
+
+class Easing:
+    @staticmethod
+    def linear(t: float):
+        return t
+
+    @staticmethod
+    def ease_in_out(t: float):
+        return 2 * t * t if t < 0.5 else 1 - 2 * (1 - t) * (1 - t)
 
 
-class MoveAnimation:
-    def __init__(self, sprite: UnitSprite, start_pos: [int, int], end_pos: [int, int]):
+class Tween:
+    def __init__(self, sprite: LayerSprite, start_pos: [float, float], end_pos: [float, float],
+                 duration: float, easing=Easing.ease_in_out, on_finish=None):
         self.sprite = sprite
         self.start_pos = start_pos
         self.end_pos = end_pos
-        self.cur_pos = start_pos[:]
+        self.duration = duration
+        self.easing = easing
+        self.on_finish = on_finish
+        self.elapsed = 0
 
-    def update(self, delta_time: float):
-        if abs(self.cur_pos[0] - self.end_pos[0]) + abs(self.cur_pos[1] - self.end_pos[1]) <= 5:
-            self.cur_pos = self.end_pos[0], self.end_pos[1]
-        else:
-            dx = (self.end_pos[0] - self.start_pos[0]) * delta_time * 2
-            dy = (self.end_pos[1] - self.start_pos[1]) * delta_time * 2
-            self.cur_pos = self.cur_pos[0] + dx, self.cur_pos[1] + dy
-            if dx > 0:
-                self.sprite.set_animation(UnitSprite.ANIMATION_MOVE_2)
-            else:
-                self.sprite.set_animation(UnitSprite.ANIMATION_MOVE)
+    def get_pos(self, lag=0):
+        t = self.easing(min(1, (self.elapsed + lag) / self.duration)) if self.duration > 0 else 1
+        return self.start_pos[0] + (self.end_pos[0] - self.start_pos[0]) * t, \
+               self.start_pos[1] + (self.end_pos[1] - self.start_pos[1]) * t
 
-        self.sprite.rect.x = self.cur_pos[0]
-        self.sprite.rect.y = self.cur_pos[1]
-        self.sprite.play_anim(delta_time=delta_time)
+    def is_finished(self):
+        return self.elapsed >= self.duration
 
 
-class MoveAnimationController:
+class TweenScheduler:
     def __init__(self):
-        self.animations = []
+        self.tweens = dict()
 
-    def add_anim(self, anim: MoveAnimation):
-        self.animations.append(anim)
+    def add(self, tween: Tween):
+        self.tweens[tween.sprite] = tween
 
-    def update(self, delta_time: float):
-        if len(self.animations) == 0:
+    def is_running(self, sprite: LayerSprite = None):
+        if sprite is None:
+            return len(self.tweens) != 0
+        return sprite in self.tweens
+
+    def update(self, delta_time: float, camera: Camera):
+        if len(self.tweens) == 0:
             return
-        del_list = []
-        for anim in self.animations:
-            anim.update(delta_time)
-            if anim.cur_pos[0] == anim.end_pos[0] and anim.cur_pos[1] == anim.end_pos[1]:
-                del_list.append(anim)
-        if len(del_list) > 0:
-            self.animations.remove(del_list[0])
+        finished = []
+        for tween in self.tweens.values():
+            tween.elapsed += delta_time
+            tween.sprite.rect.topleft = camera.to_screen(tween.get_pos())
+            if tween.is_finished():
+                finished.append(tween)
+        for tween in finished:
+            del self.tweens[tween.sprite]
+        for tween in finished:
+            if tween.on_finish is not None:
+                tween.on_finish(tween)
+
+    def interpolate(self, lag: float, camera: Camera):
+        for tween in self.tweens.values():
+            tween.sprite.rect.topleft = camera.to_screen(tween.get_pos(lag))
 
 
 class GameScene(Scene):
-    def __init__(self, layer_controller: GameLayerController, game: Game):
+    FIELD_SIZE = 94
+    UNIT_MARGIN = 20
+    UNIT_STEP = 30
+    MOVE_DURATION = 0.5
+    MOVE_HIGHLIGHT_COLOR = pygame.color.Color(0, 255, 0, 60)
+
+    def __init__(self, layer_controller: GameLayerController, game: Game, bot_players=(), autosaver: Autosaver = None):
         super().__init__(layer_controller)
         pygame.mouse.set_visible(False)
-        self._is_anim = False
         self.game = game
+        self.autosaver = autosaver
+        self.bot_players = set(bot_players)
+        # with fog the screen shows what the last human player sees, also during the bots' turns
+        cur_player_num = self.game.get_player_num(self.game.get_cur_player())
+        humans = [num for num in range(len(self.game.get_player())) if num not in self.bot_players]
+        self.view_player_num = cur_player_num if cur_player_num not in self.bot_players or not humans else humans[0]
+        self.bot = BotController() if self.bot_players else None
+        self.bot_actions = None
         board = self.game.get_board()
         self.camera = Camera(pos=(0, 0))
 
-        self.anim_controller = MoveAnimationController()
+        self.tweens = TweenScheduler()
+        self.selection = Selection()
 
         self.cur_sprite = AnimatedSprite(GameLayerController.CURSOR_LAYER, CURSOR_TEXTURES)
         self.cur_sprite.cur_frame_y = 0
@@ -435,114 +930,313 @@ class GameScene(Scene):
         self.gui = Panel(DISPLAY_SIZE)
         layer_controller.add_sprite(self.gui)
 
-        self.gui.set_player_label(self.game.get_cur_player().name, color=Panel.PLAYERS_COLORS[0])
-        self.gui.set_resources_labels(self.game.get_cur_player().resources)
+        self.update_player_labels()
         self.gui.check_button(1)
+        self.selection.subscribe(
+            lambda selection: self.gui.set_unit_label(selection.primary.unit if selection.primary else None))
+        self.selection.subscribe(self.update_highlights)
+        self.highlights = dict()
+        self.highlight_frames = WORKERS_BACKLIGHTING_TEXTURES
+        self.move_highlights = []
+        self.move_highlights_state = None
+
+        self.terrain = Terrain(board, layer_controller.layers[GameLayerController.GROUND_LAYER], DISPLAY_SIZE,
+                               self.camera.zoom, self.is_field_visible if self.game.fog is not None else None)
+        self.terrain.update(self.camera.pos)
+        self.minimap = Minimap(game, DISPLAY_SIZE, self.view_player_num)
+        self.minimap.set_view(self.camera, DISPLAY_SIZE)
+        layer_controller.add_sprite(self.minimap)
+        self.unit_frames = dict()
+        self.unit_sprites = dict()
+        for unit in self.game.get_units():
+            self.add_unit_sprite(unit, self.get_unit_sprite_pos(unit.id))
+            self.update_unit_visibility(unit)
+        self.game.subscribe(self.on_game_event)
+
+    def on_game_event(self, event):
+        if isinstance(event, FieldChanged):
+            self.terrain.redraw_field(event.pos)
+            self.minimap.refresh_field(event.pos)
+        elif isinstance(event, UnitMoved):
+            self.redraw_field(event.old_pos)
+            self.animate_move(self.unit_sprites[event.unit_id])
+            if self.game.fog is not None:
+                self.update_unit_visibility(self.game.get_unit_by_id(event.unit_id))
+            self.minimap.refresh_field(event.old_pos)
+            self.minimap.refresh_field(event.new_pos)
+        elif isinstance(event, UnitAdded):
+            self.add_unit_sprite(self.game.get_unit_by_id(event.unit_id), event.pos)
+            self.redraw_field(event.pos)
+            if self.game.fog is not None:
+                self.update_unit_visibility(self.game.get_unit_by_id(event.unit_id))
+            self.minimap.refresh_field(event.pos)
+        elif isinstance(event, ResourcesChanged):
+            if event.player_num == self.game.get_player_num(self.game.get_cur_player()):
+                self.gui.set_resources_labels(event.resources)
+        elif isinstance(event, TurnChanged):
+            if event.player_num not in self.bot_players:
+                self.set_view_player(event.player_num)
+            self.update_player_labels()
+            if self.autosaver is not None and self.autosaver.is_due(event.turn_number):
+                self.autosave()
+
+    def update_player_labels(self):
+        # a loaded game may start on any player, so the labels never assume the first one
+        player_num = self.game.get_player_num(self.game.get_cur_player())
+        self.gui.set_player_label(
+            self.game.get_cur_player().name + (' (бот)' if player_num in self.bot_players else ''),
+            color=Panel.PLAYERS_COLORS[player_num])
+        self.gui.set_resources_labels(self.game.get_cur_player().resources)
 
-        for y in range(board.size[1]):
-            for x in range(board.size[0]):
-                field = board.get_field((x, y))
-                field_pos = (x * 94, y * 94)
-                sprite = FieldSprite(field, field_pos)
-                self.add(sprite)
-                k = 0
-                for unit in field.units:
-                    unit_sprite = UnitSprite(
-                        game.get_player_num(unit.player),
-                        unit,
-                        (field_pos[0] + 20, field_pos[1] + 30 * (k - 1)))
-                    self.add(unit_sprite)
-                    k += 1
+    def autosave(self):
+        snapshot = self.game.get_snapshot()
+        snapshot['bot_players'] = sorted(self.bot_players)
+        self.autosaver.save(snapshot)
+
+    def set_view_player(self, player_num):
+        if player_num == self.view_player_num:
+            return
+        self.view_player_num = player_num
+        if self.game.fog is None:
+            return
+        # the visibility of another player is shown, so every baked cell and unit may change
+        self.redraw()
+        self.update_fog(is_full=True)
+        self.minimap.set_player(player_num)
+
+    def is_field_visible(self, field_pos):
+        return self.game.is_visible(self.game.get_player()[self.view_player_num], field_pos)
+
+    def update_unit_visibility(self, unit: Unit):
+        unit_sprite = self.unit_sprites[unit.id]
+        is_visible = self.is_field_visible(unit.pos)
+        if is_visible and not unit_sprite.alive():
+            # a hidden sprite missed the camera moves, so it is placed again
+            self.add(unit_sprite)
+            self.redraw_field(unit.pos)
+        elif not is_visible and unit_sprite.alive():
+            # a selected unit would keep its highlight and panel, showing where it went in the fog
+            unit_sprite.kill()
+            self.selection.remove(unit_sprite)
+
+    def update_fog(self, is_full=False):
+        fog = self.game.fog
+        if fog is None:
+            return
+        # the minimap keeps a picture for every player it has shown, so the changes of all players are patched in
+        for player_num in range(len(self.game.get_player())):
+            changes = fog.pop_changes(player_num)
+            self.minimap.refresh_fog(player_num, changes)
+            if player_num != self.view_player_num or is_full:
+                continue
+            for field_pos in changes:
+                self.terrain.redraw_field(field_pos)
+                for unit in self.game.get_units_on_field(field_pos):
+                    self.update_unit_visibility(unit)
+        if is_full:
+            for unit in self.game.get_units():
+                self.update_unit_visibility(unit)
+
+    def get_unit_frames(self, player_num):
+        if player_num not in self.unit_frames:
+            self.unit_frames[player_num] = SCALED_TEXTURES.get_frames(WORKERS_TEXTURES[player_num], self.camera.zoom)
+        return self.unit_frames[player_num]
+
+    def update_highlights(self, selection: Selection):
+        for unit_id in list(self.highlights.keys()):
+            if unit_id not in selection.sprites:
+                self.highlights.pop(unit_id).kill()
+        for unit_id, unit_sprite in selection.sprites.items():
+            if unit_id not in self.highlights:
+                self.highlights[unit_id] = UnitHighlightSprite(unit_sprite, self.highlight_frames)
+                self.add(self.highlights[unit_id])
+
+    def update_move_highlights(self, is_move_mode):
+        fields = frozenset(field_pos for unit_sprite in self.selection
+                           for field_pos in self.game.get_legal_moves(unit_sprite.unit.id)) if is_move_mode else None
+        state = fields, self.camera.zoom
+        if state == self.move_highlights_state:
+            return
+        self.move_highlights_state = state
+        for sprite in self.move_highlights:
+            sprite.kill()
+        self.move_highlights = []
+        if not fields:
+            return
+        field_size = self.camera.scale(self.FIELD_SIZE)
+        image = pygame.surface.Surface((field_size, field_size), pygame.SRCALPHA)
+        image.fill(self.MOVE_HIGHLIGHT_COLOR)
+        for field_pos in fields:
+            sprite = MoveHighlightSprite(image, self.get_field_screen_pos(field_pos))
+            self.move_highlights.append(sprite)
+            self.add(sprite)
+
+    def add_unit_sprite(self, unit: Unit, pos):
+        unit_sprite = UnitSprite(self.game.get_player_num(unit.player), unit, pos)
+        if self.camera.zoom != 1:
+            unit_sprite.set_frames(self.get_unit_frames(unit_sprite.player_num))
+            unit_sprite.rect.size = unit_sprite.image.get_size()
+        self.unit_sprites[unit.id] = unit_sprite
+        self.add(unit_sprite)
+        return unit_sprite
+
+    def set_zoom(self, zoom_num, center: [int, int]):
+        if not self.camera.set_zoom(zoom_num, center):
+            return
+        self.unit_frames.clear()
+        self.highlight_frames = SCALED_TEXTURES.get_frames(WORKERS_BACKLIGHTING_TEXTURES, self.camera.zoom)
+        for highlight in self.highlights.values():
+            highlight.frames = self.highlight_frames
+        self.terrain.set_zoom(self.camera.zoom)
+        self.terrain.update(self.camera.pos)
+        for unit_sprite in self.unit_sprites.values():
+            unit_sprite.set_frames(self.get_unit_frames(unit_sprite.player_num))
+            unit_sprite.rect.size = unit_sprite.image.get_size()
+        for field_pos in set(tuple(unit.pos) for unit in self.game.get_units()):
+            self.redraw_field(field_pos)
 
     def redraw(self):
-        for field_sprite in self.layer_controller.layers[GameLayerController.GROUND_LAYER].sprites():
-            field_sprite.init()
+        self.terrain.redraw()
+
+    def get_field_screen_pos(self, field_pos):
+        field_size = self.camera.scale(self.FIELD_SIZE)
+        return field_pos[0] * field_size + self.camera.pos[0], field_pos[1] * field_size + self.camera.pos[1]
+
+    def get_field_pos(self, screen_pos):
+        field_size = self.camera.scale(self.FIELD_SIZE)
+        return (screen_pos[0] - self.camera.pos[0]) // field_size, (screen_pos[1] - self.camera.pos[1]) // field_size
+
+    def get_unit_screen_pos(self, field_pos, k):
+        x, y = self.get_field_screen_pos(field_pos)
+        return x + self.camera.scale(self.UNIT_MARGIN), y + (k - 1) * self.camera.scale(self.UNIT_STEP)
 
     def redraw_field(self, field_pos):
-        k = 0
-        for unit_sprite in self.layer_controller.layers[GameLayerController.UNIT_LAYER].sprites():
+        for k, unit in enumerate(self.game.get_units_on_field(field_pos)):
+            unit_sprite = self.unit_sprites[unit.id]
+            if not self.tweens.is_running(unit_sprite):
+                unit_sprite.rect.topleft = self.get_unit_screen_pos(field_pos, k)
+
+    def animate_move(self, unit_sprite: UnitSprite):
+        end_pos = self.get_unit_sprite_pos(unit_sprite.unit.id)
+        if end_pos[0] > unit_sprite.rect.x:
+            unit_sprite.set_animation(UnitSprite.ANIMATION_MOVE_2)
+        else:
+            unit_sprite.set_animation(UnitSprite.ANIMATION_MOVE)
+        self.tweens.add(Tween(
+            unit_sprite,
+            self.camera.to_world(unit_sprite.rect.topleft),
+            self.camera.to_world(end_pos),
+            self.MOVE_DURATION,
+            on_finish=self.on_move_finish))
+
+    def on_move_finish(self, tween: Tween):
+        self.redraw_field(tween.sprite.unit.pos)
+        tween.sprite.set_animation(UnitSprite.ANIMATION_STAY)
+
+    def get_unit_sprite_at(self, pos: [int, int]):
+        x, y = self.get_field_pos(pos)
+        res = None
+        for field_pos in ((x, y), (x, y + 1)):
             field = self.game.get_field_by_coord(field_pos)
-            sp = None
-            for field_sprite in self.layer_controller.layers[GameLayerController.GROUND_LAYER].sprites():
-                if field_sprite.field == field:
-                    sp = field_sprite
-            if unit_sprite.unit in field.units:
-                unit_sprite.rect.x = sp.rect.x + 20
-                unit_sprite.rect.y = sp.rect.y + (k - 1) * 30
-                k += 1
+            if field is None:
+                continue
+            for unit in field.units:
+                unit_sprite = self.unit_sprites[unit.id]
+                if not unit_sprite.alive():
+                    continue
+                if is_point_in_rect(pos, unit_sprite.rect) and (res is None or unit.id < res.unit.id):
+                    res = unit_sprite
+        return res
+
+    def get_minimap_pos(self, key_controller: KeyController):
+        # while the left button pressed on the minimap is held, the camera follows the mouse over it
+        if key_controller.mouse_down_button != pygame.BUTTON_LEFT or \
+                not self.minimap.rect.collidepoint(key_controller.mouse_down_pos):
+            return None
+        if not key_controller.is_mouse_down:
+            key_controller.mouse_down_button = None
+            return None
+        return self.minimap.get_field_pos(key_controller.mouse_pos)
+
+    def get_center_delta(self, field_pos: [float, float]):
+        field_size = self.camera.scale(self.FIELD_SIZE)
+        return round(DISPLAY_WIDTH / 2 - field_pos[0] * field_size) - self.camera.pos[0], \
+               round(DISPLAY_HEIGHT / 2 - field_pos[1] * field_size) - self.camera.pos[1]
+
+    def select_on_click(self, key_controller: KeyController):
+        unit_sprite = self.get_unit_sprite_at(key_controller.mouse_up_pos)
+        if unit_sprite is not None and is_point_in_rect(key_controller.mouse_down_pos, unit_sprite.rect):
+            self.selection.select(unit_sprite, add=key_controller.is_shift_click())
+            key_controller.mouse_down_button = None
+
+    def is_unit_can_move_to(self, unit: Unit, field_pos):
+        return tuple(field_pos) in self.game.get_legal_moves(unit.id)
 
     def get_unit_sprite_pos(self, unit_id):
-        sp = None
         unit = self.game.get_unit_by_id(unit_id)
-        field_pos = self.game.get_unit_by_id(unit_id).pos
-        field = self.game.get_field_by_coord(field_pos)
-        for field_sprite in self.layer_controller.layers[GameLayerController.GROUND_LAYER].sprites():
-            if field_sprite.field == field:
-                sp = field_sprite
-        return sp.rect.x + 20, \
-               sp.rect.y + (self.game.get_units_on_field(field_pos).index(unit) - 1) * 30
+        return self.get_unit_screen_pos(unit.pos, self.game.get_units_on_field(unit.pos).index(unit))
 
     @property
     def select(self):
-        self._select = None
-        for unit_sprite in self.layer_controller.layers[GameLayerController.UNIT_LAYER].sprites():
-            if unit_sprite.is_selected:
-                self._select = unit_sprite
-        return self._select
+        return self.selection.primary
 
-    def update(self, *args, **kwargs):
+    def is_animating(self):
+        return self.tweens.is_running()
+
+    def draw(self, screen, lag=0):
+        if lag != 0:
+            self.tweens.interpolate(lag, self.camera)
+        super().draw(screen, lag)
 
-        if len(self.anim_controller.animations) != 0:
-            self.anim_controller.update(kwargs['delta_time'])
-            self.cur_sprite.cur_frame_y = 0
-            self.gui.check_button(1)
-            self._is_anim = True
+    def end_turn(self):
+        for unit in self.game.get_units(self.game.get_cur_player()):
+            self.unit_sprites[unit.id].set_animation(UnitSprite.ANIMATION_WORK)
+        self.game.next_turn()
+        self.is_game_over = self.game.is_game_over()
+        self.cur_sprite.cur_frame_y = 0
+        for unit in self.game.get_units(self.game.get_cur_player()):
+            self.unit_sprites[unit.id].set_animation(UnitSprite.ANIMATION_STAY)
+        self.gui.check_button(3)
+        self.update_fog()
+        self.selection.notify()
+
+    def is_bot_turn(self):
+        return self.game.get_player_num(self.game.get_cur_player()) in self.bot_players
+
+    def update_bot(self):
+        if self.bot_actions is None:
+            if not self.bot.is_thinking():
+                self.bot.start(self.game)
+            self.bot_actions = self.bot.poll()
             return
-        else:
-            if self._is_anim:
-                self._is_anim = False
-                self.redraw_field(self.select.unit.pos)
-                self.select.set_animation(UnitSprite.ANIMATION_STAY)
+        if self.bot_actions:
+            action = self.bot_actions[0]
+            if action[0] == BotActions.MOVE:
+                if self.tweens.is_running(self.unit_sprites[action[1]]):
+                    return
+                self.game.move_unit(action[1], action[2])
+            elif action[0] == BotActions.BUY:
+                self.game.buy_unit()
+            self.bot_actions.pop(0)
+        elif not self.tweens.is_running():
+            self.bot_actions = None
+            self.end_turn()
 
-        if self.select:
-            self.gui.set_unit_label(self.select.unit)
-        else:
-            self.gui.set_unit_label(unit=None)
+    def update(self, *args, **kwargs):
+        self.tweens.update(kwargs['delta_time'], self.camera)
 
         key_controller = kwargs['key_controller']
 
         if key_controller.is_key_pressed:
-            if key_controller.last_pressed_key == pygame.K_q:
-                for unit in self.game.get_units(self.game.get_cur_player()):
-                    for sprite in self.layer_controller.layers[GameLayerController.UNIT_LAYER].sprites():
-                        if sprite.unit == unit:
-                            sprite.set_animation(UnitSprite.ANIMATION_WORK)
-                self.game.next_turn()
-                self.is_game_over = self.game.is_game_over()
-                self.redraw()
-                self.cur_sprite.cur_frame_y = 0
-                self.gui.set_player_label(
-                    self.game.get_cur_player().name,
-                    color=Panel.PLAYERS_COLORS[self.game._players.index(self.game.get_cur_player())])
-                self.gui.set_resources_labels(self.game.get_cur_player().resources)
+            if self.is_bot_turn():
+                if key_controller.last_pressed_key == pygame.K_ESCAPE:
+                    self.bot.cancel()
+                    self.is_game_over = True
+            elif key_controller.last_pressed_key == pygame.K_q:
+                self.end_turn()
                 key_controller.last_pressed_key = pygame.K_c
-                for unit in self.game.get_units(self.game.get_cur_player()):
-                    for sprite in self.layer_controller.layers[GameLayerController.UNIT_LAYER].sprites():
-                        if sprite.unit == unit:
-                            sprite.set_animation(UnitSprite.ANIMATION_STAY)
-                self.gui.check_button(3)
-                self.cur_sprite.cur_frame_y = 0
             elif key_controller.last_pressed_key == pygame.K_b:
-                if self.game.buy_unit():
-                    player_num = self.game._players.index(self.game.get_cur_player())
-                    base = self.game.get_bases_coord()[player_num]
-                    self.layer_controller.add_sprite(UnitSprite(
-                        player_num=player_num,
-                        unit=self.game.get_unit_by_id(self.game.unit_count - 1),
-                        pos=base[0]))
-                    self.redraw_field(base[0])
-                    self.redraw_field(base[1])
-                    self.gui.set_resources_labels(self.game.get_cur_player().resources)
+                self.game.buy_unit()
                 self.gui.check_button(2)
                 self.cur_sprite.cur_frame_y = 0
             elif key_controller.last_pressed_key == pygame.K_m and self.select:
@@ -554,51 +1248,66 @@ class GameScene(Scene):
             elif key_controller.last_pressed_key == pygame.K_ESCAPE:
                 self.is_game_over = True
 
-        if key_controller.last_pressed_key == pygame.K_c:
-            self.camera.update(delta=key_controller.get_delta())
-        else:
-            self.camera.update(delta=(0, 0))
+        if key_controller.wheel != 0 and key_controller.mouse_pos is not None:
+            self.set_zoom(self.camera.zoom_num + key_controller.wheel, key_controller.mouse_pos)
+
+        minimap_pos = self.get_minimap_pos(key_controller)
 
         if self.select and key_controller.last_pressed_key == pygame.K_m:
-            x = key_controller.mouse_pos[0] - self.camera.pos[0]
-            y = key_controller.mouse_pos[1] - self.camera.pos[1]
-            field_pos = (x // 94, y // 94)
+            field_pos = self.get_field_pos(key_controller.mouse_pos)
 
             if self.cur_sprite.cur_frame_y >= 1:
-                if get_dist(field_pos, self.select.unit.pos) != 1 or not self.select.unit.is_can_move(field_pos) or \
-                        not self.game.is_unit_can_move(self.select.unit.id, field_pos):
+                if not self.is_unit_can_move_to(self.select.unit, field_pos):
                     self.cur_sprite.cur_frame_y = 2
                 else:
                     self.cur_sprite.cur_frame_y = 1
 
             if self.cur_sprite.cur_frame_y == 1 and key_controller.mouse_down_button == pygame.BUTTON_LEFT and \
-                    key_controller.is_mouse_down:
+                    key_controller.is_mouse_down and minimap_pos is None:
                 # if self.select.unit.player == self.game.get_cur_player():
                 #     if self.select.unit.cur_speed == 0:
                 #         self.select.set_animation(UnitSprite.ANIMATION_WORK)
                 #     else:
                 #         self.select.set_animation(UnitSprite.ANIMATION_MOVE)
-                old_unit_pos = self.select.unit.pos
-                if self.game.move_unit(self.select.unit.id, field_pos):
-                    self.redraw_field(old_unit_pos)
-                    # self.redraw_field(field_pos)
-                    self.select.set_animation(UnitSprite.ANIMATION_MOVE)
-                    self.anim_controller.add_anim(
-                        MoveAnimation(
-                            self.select,
-                            (self.select.rect.x, self.select.rect.y),
-                            self.get_unit_sprite_pos(self.select.unit.id)
-                        ))
+                # the whole selection moves as one batch, units that no longer fit on the field stay
+                self.game.apply_actions([(ActionTypes.MOVE, unit_sprite.unit.id, field_pos)
+                                         for unit_sprite in self.selection
+                                         if self.is_unit_can_move_to(unit_sprite.unit, field_pos)])
+                self.selection.notify()
+
+        self.update_move_highlights(self.select is not None and self.cur_sprite.cur_frame_y != 0)
+
+        if self.is_bot_turn() and not self.is_game_over:
+            self.update_bot()
+
+        self.update_fog()
 
         if self.select and self.cur_sprite.cur_frame_y != 0:
             key_controller.mouse_down_button = None
+        elif key_controller.is_click():
+            self.select_on_click(key_controller)
+
+        # sprites placed above are positioned from the camera of the drawn frame, so the camera moves only now
+        # and its delta is applied to them once
+        if minimap_pos is not None:
+            self.camera.update(delta=self.get_center_delta(minimap_pos))
+        elif key_controller.last_pressed_key == pygame.K_c:
+            self.camera.update(delta=key_controller.get_delta())
+        else:
+            self.camera.update(delta=(0, 0))
+        if self.camera.delta != (0, 0):
+            self.terrain.update(self.camera.pos)
+        self.minimap.set_view(self.camera, DISPLAY_SIZE)
+
         kwargs['camera'] = self.camera
         super().update(*args, **kwargs)
         self.cur_sprite.rect.x = key_controller.mouse_pos[0]
         self.cur_sprite.rect.y = key_controller.mouse_pos[1]
 
         if self.is_game_over:
-            kwargs['display'].add_scene(GameOver(self.game))
+            if self.bot is not None:
+                self.bot.cancel()
+            kwargs['display'].add_scene(GameOver(self.game, autosaver=self.autosaver))
             kwargs['display'].next()
 
 
@@ -606,8 +1315,11 @@ class Menu(Scene):
     START_BUTTON_SIZE = (180, 60)
     FONT_SIZE = 40
 
-    def __init__(self, layer_controller: LayerController):
+    def __init__(self, layer_controller: LayerController, autosaver: Autosaver = None):
         layer_controller.add_layer()
+        self.autosaver = autosaver
+        self.fog_of_war = False
+        self.with_bots = False
         self.camera = Camera()
         super().__init__(layer_controller=layer_controller)
         self.sprite = LayerSprite(0)
@@ -632,22 +1344,53 @@ class Menu(Scene):
                 font_size=self.FONT_SIZE,
                 pos=(center_x, center_y + self.START_BUTTON_SIZE[1])),
         ]
+        self.fog_button = Button(
+            size=self.START_BUTTON_SIZE,
+            text=self.get_fog_text(),
+            font_size=self.FONT_SIZE,
+            pos=(center_x, center_y + self.START_BUTTON_SIZE[1] * 3))
+        self.bots_button = Button(
+            size=self.START_BUTTON_SIZE,
+            text=self.get_bots_text(),
+            font_size=self.FONT_SIZE,
+            pos=(center_x, center_y + self.START_BUTTON_SIZE[1] * 4))
 
         [btn.draw(self.sprite.image) for btn in self.player_cnt_buttons]
+        self.fog_button.draw(self.sprite.image)
+        self.bots_button.draw(self.sprite.image)
 
         layer_controller.add_sprite(self.sprite)
 
+    def get_fog_text(self):
+        return 'туман: вкл' if self.fog_of_war else 'туман: выкл'
+
+    def get_bots_text(self):
+        return 'боты: вкл' if self.with_bots else 'боты: выкл'
+
     def update(self, *args, **kwargs):
         kwargs['camera'] = self.camera
         super().update(*args, **kwargs)
         key_controller = kwargs['key_controller']
-        if key_controller.is_mouse_down:
+        if key_controller.is_click() and self.fog_button.is_click(key_controller.mouse_up_pos):
+            self.fog_of_war = not self.fog_of_war
+            self.fog_button.text = self.get_fog_text()
+            self.fog_button.draw(self.sprite.image)
+            key_controller.mouse_down_button = None
+        elif key_controller.is_click() and self.bots_button.is_click(key_controller.mouse_up_pos):
+            self.with_bots = not self.with_bots
+            self.bots_button.text = self.get_bots_text()
+            self.bots_button.draw(self.sprite.image)
+            key_controller.mouse_down_button = None
+        elif key_controller.is_mouse_down:
             for i in range(len(self.player_cnt_buttons)):
                 if self.player_cnt_buttons[i].is_click(key_controller.mouse_pos):
                     kwargs['display'].add_scene(
                         GameScene(
                             layer_controller=GameLayerController(),
-                            game=Game(PLAYERS_NAMES[:i + 2], board_size=(10 + 3 * i, 10 + 3 * i))))
+                            game=Game(PLAYERS_NAMES[:i + 2], board_size=(10 + 3 * i, 10 + 3 * i),
+                                      fog_of_war=self.fog_of_war),
+                            bot_players=range(1, i + 2) if self.with_bots else (),
+                            autosaver=self.autosaver))
                     kwargs['display'].next()
                     break
 
@@ -656,9 +1399,17 @@ class GameOver(Scene):
     LABEL_SIZE = (430, 50)
     START_POS = (0, 200)
     MARGIN = 80
-
-    def __init__(self, game: Game):
+    GRAPH_SIZE = (340, 300)
+    GRAPH_MARGIN = 40
+    GRAPH_BACK_COLOR = pygame.color.Color(40, 40, 40)
+    GRAPH_TEXT_COLOR = pygame.color.Color('gray')
+    GRAPH_RESOURCE = ResourcesTypes.DIAMOND
+    EXPORT_KEY = pygame.K_s
+
+    def __init__(self, game: Game, autosaver: Autosaver = None):
         super().__init__(layer_controller=LayerController())
+        self.game = game
+        self.autosaver = autosaver
         self.sprite = LayerSprite(0)
         self.sprite.image = pygame.surface.Surface(DISPLAY_SIZE)
         self.camera = Camera()
@@ -678,69 +1429,289 @@ class GameOver(Scene):
                 color=Panel.PLAYERS_COLORS[winners[i][2]])
             lbl.draw(self.sprite.image, (DISPLAY_SIZE[0] // 2 - self.LABEL_SIZE[0] // 2, i * self.MARGIN))
 
+        self.draw_graph(self.sprite.image, Rect(
+            (DISPLAY_SIZE[0] // 2 + self.LABEL_SIZE[0] // 2 + self.GRAPH_MARGIN, 0), self.GRAPH_SIZE))
+
         self.layer_controller.add_layer()
         self.layer_controller.add_sprite(self.sprite)
 
+    def draw_graph(self, surface, rect: Rect):
+        stats = self.game.stats
+        font = FONTS.get_font('Comic Sans MS', 18)
+        surface.fill(self.GRAPH_BACK_COLOR, rect)
+        surface.blit(FONTS.render(font, ResourcesTypes.VISIBLE_NAMES[self.GRAPH_RESOURCE] + ' по ходам',
+                                  self.GRAPH_TEXT_COLOR), (rect.x + 5, rect.y))
+        surface.blit(FONTS.render(font, 'S - сохранить статистику', self.GRAPH_TEXT_COLOR), (rect.x, rect.bottom + 5))
+        if stats is None or len(stats) < 2:
+            return
+        plot = rect.inflate(-20, -40).move(0, 10)
+        res_name = ResourcesTypes.NAMES[self.GRAPH_RESOURCE]
+        series = [stats.get_column(f'p{i}_{res_name}') for i in range(len(self.game.get_player()))]
+        max_value = max(1, max(max(values) for values in series))
+        for i, values in enumerate(series):
+            points = [(plot.x + plot.width * k // (len(values) - 1), plot.bottom - plot.height * value // max_value)
+                      for k, value in enumerate(values)]
+            pygame.draw.lines(surface, Panel.PLAYERS_COLORS[i], False, points, 2)
+
     def update(self, *args, **kwargs):
         kwargs['camera'] = self.camera
         super().update(*args, **kwargs)
         key_controller = kwargs['key_controller']
+        if key_controller.is_key_pressed and key_controller.last_pressed_key == self.EXPORT_KEY:
+            file_name = time.strftime('stats_%Y%m%d_%H%M%S')
+            self.game.stats.export_csv(file_name + '.csv')
+            self.game.stats.export_npy(file_name + '.npy')
         if key_controller.is_key_pressed and key_controller.last_pressed_key == pygame.K_ESCAPE:
-            kwargs['display'].add_scene(Menu(LayerController()))
+            kwargs['display'].add_scene(Menu(LayerController(), autosaver=self.autosaver))
             kwargs['display'].next()
 
 
+class ProfilerOverlay:
+    BACK_COLOR = pygame.color.Color(0, 0, 0, 180)
+    TEXT_COLOR = pygame.color.Color(0, 255, 0)
+    FONT_SIZE = 14
+    LINE_HEIGHT = 16
+    REFRESH_TIME = 0.5
+    POS = (5, 5)
+
+    def __init__(self):
+        self.image = None
+        self.last_refresh = 0
+
+    def get_lines(self):
+        lines = ['%-22s %7s %7s %7s' % (('section',) + tuple('p%d ms' % p for p in PROFILER.PERCENTILES))]
+        for name in PROFILER.get_section_names():
+            percentiles = tuple(value * 1000 for value in PROFILER.get_percentiles(name))
+            lines.append('%-22s %7.2f %7.2f %7.2f' % ((name,) + percentiles))
+        for name, value in PROFILER.get_last_counters().items():
+            lines.append('%-22s %7d' % (name, value))
+        lines.append('F3 - hide, F4 - dump trace')
+        return lines
+
+    def refresh(self):
+        font = FONTS.get_font('Courier New', self.FONT_SIZE)
+        lines = self.get_lines()
+        surfaces = [font.render(line, True, self.TEXT_COLOR) for line in lines]
+        width = max(surface.get_width() for surface in surfaces) + 10
+        self.image = pygame.surface.Surface((width, len(lines) * self.LINE_HEIGHT + 10), pygame.SRCALPHA)
+        self.image.fill(self.BACK_COLOR)
+        for i in range(len(surfaces)):
+            self.image.blit(surfaces[i], (5, 5 + i * self.LINE_HEIGHT))
+
+    def draw(self, surface):
+        now = time.perf_counter()
+        if self.image is None or now - self.last_refresh >= self.REFRESH_TIME:
+            self.refresh()
+            self.last_refresh = now
+        surface.blit(self.image, self.POS)
+        PROFILER.count('blits')
+
+
 class Display:
-    def __init__(self, display_size=DISPLAY_SIZE, scene: Scene = None):
+    PROFILER_KEY = pygame.K_F3
+    PROFILER_DUMP_KEY = pygame.K_F4
+
+    def __init__(self, display_size=DISPLAY_SIZE, scene: Scene = None, event_source=None, vsync=False,
+                 frame_recorder: FrameRecorder = None):
         self.display_size = display_size
-        self.screen = pygame.display.set_mode(self.display_size)
+        self.frame_recorder = frame_recorder
+        self.screen = self.set_mode(display_size, vsync)
         self.scenes = [scene]
         self.cur_scene = None
         self.running = True
-        self.key_controller = KeyController()
+        self.event_source = event_source
+        self.key_controller = KeyController(event_source)
+        self.key_controller.system_keys.update((self.PROFILER_KEY, self.PROFILER_DUMP_KEY))
+        self.profiler_overlay = ProfilerOverlay()
+        self.is_full_redraw = True
+        self.is_changed = True
+        self.dirty_rects = []
         self.next()
 
+    @staticmethod
+    def set_mode(display_size, vsync=False):
+        if vsync:
+            try:
+                return pygame.display.set_mode(display_size, pygame.SCALED, vsync=1)
+            except pygame.error:
+                pass
+        return pygame.display.set_mode(display_size)
+
     def add_scene(self, scene: Scene):
         self.scenes.append(scene)
 
     def next(self):
         self.cur_scene = self.scenes.pop()
+        self.is_changed = True
+
+    def add_dirty_rects(self, rects):
+        self.dirty_rects.extend(rects)
+
+    def draw_dirty(self, lag=0):
+        # widgets repainted without a full redraw: the scene is drawn again only inside the changed area,
+        # so the partial display update shows their new pixels
+        area = Rect(self.dirty_rects[0]).unionall(self.dirty_rects[1:])
+        self.screen.set_clip(area)
+        self.screen.fill(color=pygame.color.Color(0, 0, 0), rect=area)
+        if self.cur_scene is not None:
+            self.cur_scene.draw(self.screen, lag)
+        self.screen.set_clip(None)
+
+    def need_redraw(self):
+        return self.is_changed or PROFILER.enabled or \
+               self.cur_scene is not None and self.cur_scene.is_animating()
 
-    def draw(self):
+    def draw(self, lag=0):
         self.screen.fill(color=pygame.color.Color(0, 0, 0),
                          rect=Rect((0, 0), self.display_size))
         if self.cur_scene is not None:
-            self.cur_scene.draw(self.screen)
+            self.cur_scene.draw(self.screen, lag)
+        if PROFILER.enabled:
+            self.profiler_overlay.draw(self.screen)
+        self.is_full_redraw = True
+        self.is_changed = False
 
     def update(self, *args, **kwargs):
+        start = PROFILER.start()
         self.key_controller.update(*args, **kwargs)
+        PROFILER.stop('events', start)
+        self.handle_system_keys()
+        if ANIMATION_CLOCK.update(kwargs['delta_time']) or self.key_controller.has_events:
+            self.is_changed = True
         if self.cur_scene is not None:
-            self.cur_scene.update(
+            scene = self.cur_scene
+            start = PROFILER.start()
+            scene.update(
                 *args,
                 key_controller=self.key_controller,
                 display=self,
                 **kwargs)
+            PROFILER.stop('scene logic', start, exclude=scene.layer_controller.update_time)
+
+    def handle_system_keys(self):
+        for key in self.key_controller.pressed_system_keys:
+            if key == self.PROFILER_KEY:
+                PROFILER.toggle()
+                self.is_changed = True
+            elif key == self.PROFILER_DUMP_KEY and PROFILER.enabled:
+                PROFILER.dump(time.strftime('profile_%Y%m%d_%H%M%S.json'))
 
     def flip(self):
-        pygame.display.flip()
+        start = PROFILER.start()
+        is_updated = self.is_full_redraw or len(self.dirty_rects) != 0
+        self.flip_screen()
+        PROFILER.stop('flip', start)
+        if is_updated and self.frame_recorder is not None:
+            start = PROFILER.start()
+            self.frame_recorder.capture(self.screen)
+            PROFILER.stop('capture', start)
+
+    def flip_screen(self):
+        if self.is_full_redraw:
+            pygame.display.flip()
+        elif len(self.dirty_rects) != 0:
+            pygame.display.update(self.dirty_rects)
+        self.is_full_redraw = False
+        self.dirty_rects = []
 
     def quit(self):
+        if self.event_source is not None:
+            self.event_source.close()
+        if self.frame_recorder is not None:
+            self.frame_recorder.close()
         pygame.display.quit()
 
     def __call__(self, *args, **kwargs):
         return self.screen
 
 
-pygame.init()
-pygame.font.init()
-
-display = Display(scene=Menu(layer_controller=LayerController()))
-
-clock = pygame.time.Clock()
-
-while not display.key_controller.is_quit:
-    delta_time = clock.tick(60) / 1000
-    display.update(delta_time=delta_time)
-    display.draw()
-    display.flip()
-display.quit()
+class GameLoop:
+    STEP = 1 / 60
+    MAX_FRAME_TIME = 0.25
+
+    def __init__(self, display: Display, fps=60, step=STEP, fixed_delta=None):
+        self.display = display
+        self.fps = fps
+        self.step = step
+        self.fixed_delta = fixed_delta
+        self.clock = pygame.time.Clock()
+        self.accumulator = 0
+
+    def tick(self):
+        frame_time = min(self.clock.tick(self.fps) / 1000, self.MAX_FRAME_TIME)
+        # the frame starts after the frame cap sleep, so 'frame' is the work done and not the pacing
+        PROFILER.begin_frame()
+        if self.fixed_delta is not None:
+            self.display.update(delta_time=self.fixed_delta)
+        else:
+            self.accumulator += frame_time
+            while self.accumulator >= self.step and not self.display.key_controller.is_quit:
+                self.display.update(delta_time=self.step)
+                self.accumulator -= self.step
+        if self.display.need_redraw():
+            self.display.draw(lag=self.accumulator)
+        elif len(self.display.dirty_rects) != 0:
+            self.display.draw_dirty(lag=self.accumulator)
+        self.display.flip()
+        PROFILER.end_frame()
+
+    def run(self):
+        while not self.display.key_controller.is_quit:
+            self.tick()
+        self.display.quit()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Копатели')
+    parser.add_argument('--record', metavar='FILE', help='записать ввод в файл')
+    parser.add_argument('--play', metavar='FILE', help='воспроизвести ввод из файла')
+    parser.add_argument('--fast', action='store_true', help='воспроизводить без ограничения частоты кадров')
+    parser.add_argument('--fps', type=int, default=60, help='ограничение частоты кадров (0 - без ограничения)')
+    parser.add_argument('--vsync', action='store_true', help='включить вертикальную синхронизацию')
+    parser.add_argument('--capture', metavar='DIR', help='записывать кадры в папку')
+    parser.add_argument('--capture-format', choices=FrameRecorder.FORMATS, default='png',
+                        help='формат записи кадров: png или raw (RGB подряд в одном файле)')
+    parser.add_argument('--autosave', type=int, default=Autosaver.EVERY, metavar='N',
+                        help='автосохранение каждые N ходов (0 - выключить)')
+    parser.add_argument('--autosave-keep', type=int, default=Autosaver.KEEP, metavar='K',
+                        help='сколько последних автосохранений хранить')
+    parser.add_argument('--autosave-dir', metavar='DIR', default='saves', help='папка автосохранений')
+    parser.add_argument('--load', metavar='FILE', help='продолжить игру из сохранения')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    pygame.init()
+    pygame.font.init()
+
+    event_source = None
+    if args.play is not None:
+        event_source = InputPlayer(args.play)
+    elif args.record is not None:
+        event_source = InputRecorder(args.record)
+
+    frame_recorder = None
+    if args.capture is not None:
+        frame_recorder = FrameRecorder(args.capture, args.capture_format)
+
+    autosaver = None
+    if args.autosave > 0:
+        autosaver = Autosaver(args.autosave_dir, args.autosave, args.autosave_keep)
+
+    if args.load is not None:
+        snapshot = load_snapshot(args.load)
+        scene = GameScene(layer_controller=GameLayerController(), game=Game.from_snapshot(snapshot),
+                          bot_players=snapshot.get('bot_players', ()), autosaver=autosaver)
+    else:
+        scene = Menu(layer_controller=LayerController(), autosaver=autosaver)
+    display = Display(scene=scene, event_source=event_source, vsync=args.vsync, frame_recorder=frame_recorder)
+
+    if isinstance(event_source, InputPlayer):
+        game_loop = GameLoop(display, fps=0 if args.fast else args.fps, fixed_delta=event_source.delta_time)
+    else:
+        game_loop = GameLoop(display, fps=args.fps)
+    game_loop.run()
+    if autosaver is not None:
+        autosaver.close()
@@ -0,0 +1,88 @@
+import json
+import time
+from collections import deque
+
+
+class FrameProfiler:
+    HISTORY_SIZE = 300
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, history_size=HISTORY_SIZE):
+        self.enabled = False
+        self.frames = deque(maxlen=history_size)
+        self._frame = None
+        self._frame_start = 0
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.frames.clear()
+
+    def begin_frame(self):
+        if not self.enabled:
+            self._frame = None
+            return
+        self._frame_start = time.perf_counter()
+        self._frame = {'start': self._frame_start, 'events': [], 'sections': dict(), 'counters': dict()}
+
+    def end_frame(self):
+        if self._frame is None:
+            return
+        self._frame['sections']['frame'] = time.perf_counter() - self._frame_start
+        self.frames.append(self._frame)
+        self._frame = None
+
+    def start(self):
+        return time.perf_counter() if self._frame is not None else None
+
+    def stop(self, name, start, exclude=0):
+        if start is None or self._frame is None:
+            return 0
+        duration = time.perf_counter() - start
+        self._frame['events'].append((name, start - self._frame_start, duration))
+        sections = self._frame['sections']
+        sections[name] = sections.get(name, 0) + duration - exclude
+        return duration
+
+    def count(self, name, value=1):
+        if self._frame is not None:
+            counters = self._frame['counters']
+            counters[name] = counters.get(name, 0) + value
+
+    def get_section_names(self):
+        names = []
+        for frame in self.frames:
+            for name in frame['sections']:
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def get_percentiles(self, name):
+        values = sorted(frame['sections'].get(name, 0) for frame in self.frames)
+        if len(values) == 0:
+            return tuple(0 for _ in self.PERCENTILES)
+        return tuple(values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))] for p in self.PERCENTILES)
+
+    def get_last_counters(self):
+        return self.frames[-1]['counters'] if len(self.frames) != 0 else dict()
+
+    def dump(self, file_name):
+        if len(self.frames) == 0:
+            return False
+        first_start = self.frames[0]['start']
+        trace_events = []
+        for frame in self.frames:
+            frame_ts = (frame['start'] - first_start) * 1e6
+            trace_events.append({'name': 'frame', 'ph': 'X', 'pid': 0, 'tid': 0,
+                                 'ts': frame_ts, 'dur': frame['sections']['frame'] * 1e6})
+            for name, start, duration in frame['events']:
+                trace_events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': 0,
+                                     'ts': frame_ts + start * 1e6, 'dur': duration * 1e6})
+            for name, value in frame['counters'].items():
+                trace_events.append({'name': name, 'ph': 'C', 'pid': 0, 'tid': 0,
+                                     'ts': frame_ts, 'args': {'value': value}})
+        with open(file_name, 'w', encoding='utf-8') as data:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, data)
+        return True
+
+
+PROFILER = FrameProfiler()
@@ -0,0 +1,108 @@
+import csv
+import struct
+import sys
+from array import array
+
+
+class TurnStats:
+    DEFAULT_CAPACITY = 4096
+    PLAYER_COLUMNS = ('units', 'excavated')
+    NPY_MAGIC = b'\x93NUMPY'
+
+    def __init__(self, game, resources_names, grounds_names, capacity=DEFAULT_CAPACITY):
+        self.players_count = len(game.get_player())
+        self.resources_count = len(resources_names)
+        self.player_size = self.resources_count + len(self.PLAYER_COLUMNS)
+        self.grounds_offset = 1 + self.players_count * self.player_size
+        self.row_size = self.grounds_offset + len(grounds_names)
+        self.columns = ['turn']
+        for player_num in range(self.players_count):
+            self.columns.extend(f'p{player_num}_{name}' for name in resources_names)
+            self.columns.extend(f'p{player_num}_{name}' for name in self.PLAYER_COLUMNS)
+        self.columns.extend(f'ground_{name}' for name in grounds_names)
+
+        self.capacity = capacity
+        self.data = array('q', bytes(8 * capacity * self.row_size))
+        self.start = 0
+        self.count = 0
+
+        self.excavated = array('q', bytes(8 * self.players_count))
+        self.ground_counts = array('q', bytes(8 * len(grounds_names)))
+        board = game.get_board()
+        for y in range(board.size[1]):
+            for x in range(board.size[0]):
+                self.ground_counts[board.get_field((x, y)).type] += 1
+        self.record(game)
+
+    def on_turn(self, game, changed):
+        player_num = game.get_player_num(game.get_cur_player())
+        for pos, old_type in changed:
+            self.ground_counts[old_type] -= 1
+            self.ground_counts[game.get_field_by_coord(pos).type] += 1
+            self.excavated[player_num] += 1
+        self.record(game)
+
+    def record(self, game):
+        if self.count < self.capacity:
+            row = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            row = self.start
+            self.start = (self.start + 1) % self.capacity
+        data = self.data
+        offset = row * self.row_size
+        data[offset] = game.turn_number
+        players = game.get_player()
+        for player_num in range(self.players_count):
+            player_offset = offset + 1 + player_num * self.player_size
+            resources = players[player_num].resources
+            for i in range(self.resources_count):
+                data[player_offset + i] = resources[i]
+            data[player_offset + self.resources_count] = 0
+            data[player_offset + self.resources_count + 1] = self.excavated[player_num]
+        units_offset = offset + 1 + self.resources_count
+        for unit in game.get_units():
+            data[units_offset + game.get_player_num(unit.player) * self.player_size] += 1
+        grounds_offset = offset + self.grounds_offset
+        for i in range(len(self.ground_counts)):
+            data[grounds_offset + i] = self.ground_counts[i]
+
+    def __len__(self):
+        return self.count
+
+    def get_rows_slices(self):
+        end = self.start + self.count
+        if end <= self.capacity:
+            return [(self.start * self.row_size, end * self.row_size)]
+        return [(self.start * self.row_size, self.capacity * self.row_size),
+                (0, (end - self.capacity) * self.row_size)]
+
+    def get_column(self, name):
+        column = self.columns.index(name)
+        res = []
+        for start, end in self.get_rows_slices():
+            res.extend(self.data[start + column:end:self.row_size])
+        return res
+
+    def get_rows(self):
+        for start, end in self.get_rows_slices():
+            for offset in range(start, end, self.row_size):
+                yield self.data[offset:offset + self.row_size]
+
+    def export_csv(self, file_name):
+        with open(file_name, 'w', newline='', encoding='utf-8') as data:
+            writer = csv.writer(data)
+            writer.writerow(self.columns)
+            writer.writerows(self.get_rows())
+
+    def export_npy(self, file_name):
+        header = "{'descr': '<i8', 'fortran_order': False, 'shape': (%d, %d), }" % (self.count, self.row_size)
+        # magic, version and header length take 10 bytes, the whole header is padded to 64 bytes
+        header += ' ' * (63 - (10 + len(header)) % 64) + '\n'
+        with open(file_name, 'wb') as data:
+            data.write(self.NPY_MAGIC + struct.pack('<BBH', 1, 0, len(header)) + header.encode('latin1'))
+            for start, end in self.get_rows_slices():
+                rows = self.data[start:end]
+                if sys.byteorder == 'big':
+                    rows.byteswap()
+                data.write(rows.tobytes())
@@ -1,6 +1,7 @@
 import json
 import pygame
 import os
+from collections import OrderedDict
 
 DEFAULT_COLORKEY = -1
 
@@ -59,6 +60,47 @@ class ImageHandler:
         return res
 
 
+class ScaledTextureCache:
+    def __init__(self, memory_budget: int):
+        self.memory_budget = memory_budget
+        self.memory = 0
+        self._cache = OrderedDict()
+
+    @staticmethod
+    def get_memory_size(image):
+        return image.get_width() * image.get_height() * image.get_bytesize()
+
+    def get(self, image, scale: float):
+        if scale == 1:
+            return image
+        key = (id(image), scale)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key][1]
+        size = max(1, round(image.get_width() * scale)), max(1, round(image.get_height() * scale))
+        if image.get_bytesize() in (3, 4):
+            scaled = pygame.transform.smoothscale(image, size)
+        else:
+            scaled = pygame.transform.scale(image, size)
+        # keep the source surface alive so its id is not reused by another surface
+        self._cache[key] = (image, scaled)
+        self.memory += self.get_memory_size(scaled)
+        while self.memory > self.memory_budget and len(self._cache) > 1:
+            _, (_, old) = self._cache.popitem(last=False)
+            self.memory -= self.get_memory_size(old)
+        return scaled
+
+    def get_frames(self, frames: tuple, scale: float):
+        return tuple(tuple(self.get(frame, scale) for frame in row) for row in frames)
+
+    def get_textures(self, textures: list, scale: float):
+        return [self.get(texture, scale) for texture in textures]
+
+    def clear(self):
+        self._cache.clear()
+        self.memory = 0
+
+
 class TextureLoader:
     def __init__(self, json_file):
         json_file = os.path.join(VALUES_DIRECTORY_PATH, json_file)
@@ -76,27 +118,19 @@ class TextureWorkerLoader(TextureLoader):
         super().__init__(json_file)
 
     def load(self):
-        worker_dict = self.json['worker']
-
-        images = [ImageHandler.load_image(file_name) for file_name in worker_dict['files'][:-1]]
-        image_back = ImageHandler.load_image(worker_dict['files'][-1])
-
-        workers_images = []
+        return [self.load_frames(file_name) for file_name in self.json['worker']['files'][:-1]]
 
-        for image in images:
-            joined_image = ImageHandler.join(image_back, image)
+    def load_backlighting(self):
+        return self.load_frames(self.json['worker']['files'][-1])
 
-            normal_frames = ImageHandler.cut_sheet(image, worker_dict['frame_size'])
-            joined_frames = ImageHandler.cut_sheet(joined_image, worker_dict['frame_size'])
-
-            fs = ImageHandler.get_frames_sheet(normal_frames, worker_dict['animation_rows'])
-            fs.append([pygame.transform.flip(fr, True, False) for fr in fs[2][:]])
+    def load_frames(self, file_name):
+        worker_dict = self.json['worker']
 
-            fs2 = ImageHandler.get_frames_sheet(joined_frames, worker_dict['animation_rows'])
-            fs2.append([pygame.transform.flip(fr, True, False) for fr in fs2[2][:]])
+        frames = ImageHandler.cut_sheet(ImageHandler.load_image(file_name), worker_dict['frame_size'])
 
-            workers_images.append(fs + fs2)
-        return workers_images
+        fs = ImageHandler.get_frames_sheet(frames, worker_dict['animation_rows'])
+        fs.append([pygame.transform.flip(fr, True, False) for fr in fs[2][:]])
+        return tuple(tuple(row) for row in fs)
 
 
 class TextureGroundLoader(TextureLoader):
@@ -138,9 +172,13 @@ pygame.init()
 screen = pygame.display.set_mode((1000, 800))
 
 WORKERS_TEXTURES = TextureWorkerLoader().load()
+WORKERS_BACKLIGHTING_TEXTURES = TextureWorkerLoader().load_backlighting()
 GROUNDS_TEXTURES = TextureGroundLoader().load()
 CURSOR_TEXTURES = TextureCursorLoader().load()
 
+SCALED_TEXTURES_MEMORY_BUDGET = 64 * 1024 * 1024
+SCALED_TEXTURES = ScaledTextureCache(SCALED_TEXTURES_MEMORY_BUDGET)
+
 if __name__ == '__main__':
     running = True
 
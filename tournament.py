@@ -0,0 +1,188 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+import zlib
+
+from bot import BOT_POLICIES, BotController
+from game import Game, ResourcesTypes
+
+BOARD_SIZES = (10, 13, 16)
+ROUNDS = 4
+MAX_TURNS = 300
+SEED = 1
+BASES_COUNT = 4
+
+ELO_START = 1500
+ELO_K = 16
+BOOTSTRAP_SAMPLES = 200
+Z_95 = 1.96
+
+
+def get_matches(policies, board_sizes, rounds, seed):
+    matches = []
+    for first, second in itertools.combinations(policies, 2):
+        for board_size in board_sizes:
+            for round_num in range(rounds):
+                match_id = f'{first}-{second}-{board_size}-{round_num}'
+                matches.append({
+                    'id': match_id,
+                    'policies': [first, second],
+                    'board_size': board_size,
+                    'seed': zlib.crc32(f'{seed}:{match_id}'.encode('utf-8')),
+                })
+    return matches
+
+
+def play_match(match, max_turns, time_limit):
+    rng = random.Random(match['seed'])
+    policies = match['policies'][:]
+    rng.shuffle(policies)
+    seats = rng.sample(range(BASES_COUNT), len(policies))
+    random.seed(match['seed'])
+    game = Game(policies, board_size=(match['board_size'], match['board_size']), seats=seats, stats_capacity=1)
+    while game.turn_number < max_turns and not game.is_game_over():
+        policy = policies[game.get_player_num(game.get_cur_player())]
+        BOT_POLICIES[policy](game).compute(time.monotonic() + time_limit)
+        game.next_turn()
+    scores = [player.resources[ResourcesTypes.DIAMOND] for player in game.get_player()]
+    best = max(scores)
+    winners = [policies[i] for i in range(len(policies)) if scores[i] == best]
+    return {
+        'id': match['id'],
+        'policies': policies,
+        'seats': seats,
+        'board_size': match['board_size'],
+        'seed': match['seed'],
+        'turns': game.turn_number,
+        'scores': scores,
+        'winner': winners[0] if len(winners) == 1 else None,
+    }
+
+
+def play_match_args(args):
+    return play_match(*args)
+
+
+def load_results(file_name):
+    results = dict()
+    if file_name is None or not os.path.exists(file_name):
+        return results
+    with open(file_name, encoding='utf-8') as data:
+        for line in data:
+            # a run killed mid-write leaves a truncated last line, that match is simply played again
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            results[result['id']] = result
+    return results
+
+
+def run(matches, results, file_name, workers, max_turns, time_limit):
+    pending = [match for match in matches if match['id'] not in results]
+    print(f'{len(matches) - len(pending)} of {len(matches)} matches already played, {workers} workers')
+    if not pending:
+        return
+    out = open(file_name, 'a', encoding='utf-8') if file_name is not None else None
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            args = [(match, max_turns, time_limit) for match in pending]
+            for i, result in enumerate(pool.imap_unordered(play_match_args, args)):
+                results[result['id']] = result
+                if out is not None:
+                    out.write(json.dumps(result) + '\n')
+                    out.flush()
+                print(f'[{i + 1}/{len(pending)}] {result["id"]}: {result["policies"]} {result["scores"]} '
+                      f'-> {result["winner"] or "draw"}')
+                sys.stdout.flush()
+    finally:
+        if out is not None:
+            out.close()
+
+
+def get_score(result, policy):
+    if result['winner'] is None:
+        return 0.5
+    return 1 if result['winner'] == policy else 0
+
+
+def get_elo(results, policies):
+    ratings = dict((policy, ELO_START) for policy in policies)
+    for result in results:
+        first, second = result['policies']
+        expected = 1 / (1 + 10 ** ((ratings[second] - ratings[first]) / 400))
+        delta = ELO_K * (get_score(result, first) - expected)
+        ratings[first] += delta
+        ratings[second] -= delta
+    return ratings
+
+
+def get_elo_intervals(results, policies, rng):
+    samples = dict((policy, []) for policy in policies)
+    for _ in range(BOOTSTRAP_SAMPLES):
+        ratings = get_elo([rng.choice(results) for _ in results], policies)
+        for policy in policies:
+            samples[policy].append(ratings[policy])
+    intervals = dict()
+    for policy, values in samples.items():
+        values.sort()
+        intervals[policy] = values[int(0.025 * (len(values) - 1))], values[int(0.975 * (len(values) - 1))]
+    return intervals
+
+
+def get_wilson_interval(score, games):
+    if games == 0:
+        return 0, 1
+    p = score / games
+    denominator = 1 + Z_95 ** 2 / games
+    center = (p + Z_95 ** 2 / (2 * games)) / denominator
+    half = Z_95 * math.sqrt(p * (1 - p) / games + Z_95 ** 2 / (4 * games ** 2)) / denominator
+    return center - half, center + half
+
+
+def print_table(results, policies, seed):
+    results = sorted(results, key=lambda result: result['id'])
+    elo = get_elo(results, policies)
+    intervals = get_elo_intervals(results, policies, random.Random(seed)) if results else \
+        dict((policy, (ELO_START, ELO_START)) for policy in policies)
+    print('%-10s %6s %5s %5s %6s %19s %19s' % ('policy', 'games', 'wins', 'draws', 'losses', 'win rate (95% CI)',
+                                               'elo (95% CI)'))
+    for policy in sorted(policies, key=lambda name: -elo[name]):
+        games = [result for result in results if policy in result['policies']]
+        wins = sum(1 for result in games if result['winner'] == policy)
+        draws = sum(1 for result in games if result['winner'] is None)
+        score = wins + draws / 2
+        low, high = get_wilson_interval(score, len(games))
+        print('%-10s %6d %5d %5d %6d %6.2f [%.2f, %.2f] %6.0f [%.0f, %.0f]' % (
+            policy, len(games), wins, draws, len(games) - wins - draws, score / len(games) if games else 0, low, high,
+            elo[policy], intervals[policy][0], intervals[policy][1]))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Круговой турнир между стратегиями ботов (без окна)')
+    parser.add_argument('--policies', nargs='+', choices=sorted(BOT_POLICIES), default=sorted(BOT_POLICIES),
+                        help='участвующие стратегии')
+    parser.add_argument('--sizes', type=int, nargs='+', default=BOARD_SIZES, help='размеры поля')
+    parser.add_argument('--rounds', type=int, default=ROUNDS, help='партий на каждую пару и размер поля')
+    parser.add_argument('--turns', type=int, default=MAX_TURNS, help='ограничение числа ходов в партии')
+    parser.add_argument('--time-limit', type=float, default=BotController.TIME_LIMIT, help='секунд на ход бота')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='число рабочих процессов')
+    parser.add_argument('--seed', type=int, default=SEED, help='зерно генератора турнира')
+    parser.add_argument('--out', metavar='FILE', default='tournament.jsonl',
+                        help='файл результатов, уже сыгранные в нём партии не переигрываются')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    matches = get_matches(args.policies, args.sizes, args.rounds, args.seed)
+    results = load_results(args.out)
+    run(matches, results, args.out, args.workers, args.turns, args.time_limit)
+    match_ids = set(match['id'] for match in matches)
+    print_table([result for result in results.values() if result['id'] in match_ids], args.policies, args.seed)